@@ -1,2 +1,13 @@
+from importlib import import_module
 from .bg_augment_base import BgAugmentBase
-from .barcode_augment import BarcodeAugment
+
+
+# augments are imported on first use, they pull heavy optional dependencies (python-barcode, cv2)
+_augments = {'BarcodeAugment': '.barcode_augment'}
+
+
+def __getattr__(name: str):
+    if name in _augments:
+        return getattr(import_module(_augments[name], __name__), name)
+
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -1,4 +1,5 @@
 import cv2
+import masks
 import random
 import numpy as np
 import math
@@ -9,36 +10,64 @@ from barcode import EAN13
 from barcode.writer import ImageWriter
 
 
+'''
+BarcodeAugment(atlas_size)
+pastes a random EAN13 barcode on the image
+
+barcodes are rendered once into an atlas of atlas_size ink masks, built lazily:
+atlas entry k always holds the same code, so the pages do not depend on which entries are already rendered,
+each page picks an entry and recolours, resizes, crops, rotates and blends it in numpy
+'''
+
+
 class BarcodeAugment(BgAugmentBase):
-    def __init__(self) -> None:
+    def __init__(self, atlas_size: int = 64, rng: random.Random = None) -> None:
+        super().__init__(rng)
         self.barcode_squere = (0.01, 0.05)
         self.barcode_angle = (-2, 2)
         self.barcode_color = ((0, 250), (0, 250), (0, 250))
+        self.atlas_size = atlas_size
+        self.atlas = {}
+
+    def _barcode(self, k: int) -> np.ndarray:
+        '''ink mask of the atlas entry k, (h, w) uint8, 255 is a bar'''
+        if k not in self.atlas:
+            rng = random.Random(k)
+            code = ''.join([str(rng.randint(0, 1)) for i in range(12)])
+            barcode = EAN13(code, writer=ImageWriter()).render()
+            _barcode_crop_points = (72, 7, 452, 193)
+            barcode = barcode.crop(_barcode_crop_points).convert('L')
+            self.atlas[k] = 255 - np.array(barcode)
+
+        return self.atlas[k]
 
     def augment(self, image: Image.Image) -> Image.Image:
         image_size = image.size
-        code = ''.join([str(random.randint(0, 1)) for i in range(12)])
-        barcode = EAN13(code, writer=ImageWriter()).render()
-        _barcode_crop_points = (72, 7, 452, 193)
-        barcode = barcode.crop(_barcode_crop_points)
-        barcode = np.array(barcode)
-        barcode = cv2.cvtColor(barcode, cv2.COLOR_RGB2BGRA)
-        barcode[:, :, 3] = (barcode[:, :, 2] - 255) * -1
-        barcode[:, :, 0] += random.randint(*self.barcode_color[0])
-        barcode[:, :, 1] += random.randint(*self.barcode_color[1])
-        barcode[:, :, 2] += random.randint(*self.barcode_color[2])
-        barcode = Image.fromarray(barcode)
-        barcode_squere = random.uniform(*self.barcode_squere) * image_size[0] * image_size[1]
-        barcode_h = int(math.sqrt(barcode_squere * barcode.size[1] / barcode.size[0]))
-        barcode_w = int(barcode_h * barcode.size[0] / barcode.size[1])
-        barcode = barcode.resize((barcode_w, barcode_h))
-        barcode = barcode.crop((0, 0, barcode.size[0], random.randint(int(barcode.size[1] * 0.3), barcode.size[1])))
-        barcode = barcode.rotate(random.uniform(*self.barcode_angle), expand=True, resample=Image.BICUBIC)
-        image.convert('RGBA')
-        barcode_coord = (random.randint(0, image.size[0]), random.randint(0, image.size[1]))
-        image.paste(barcode, barcode_coord, barcode)
-        image = image.convert('RGB')
-        return image
+        ink = self._barcode(self.rng.randrange(self.atlas_size))
+        color = np.array([self.rng.randint(*c) for c in self.barcode_color], dtype=np.float32)
+        barcode_squere = self.rng.uniform(*self.barcode_squere) * image_size[0] * image_size[1]
+        barcode_h = int(math.sqrt(barcode_squere * ink.shape[0] / ink.shape[1]))
+        barcode_w = int(barcode_h * ink.shape[1] / ink.shape[0])
+
+        if barcode_h <= 0 or barcode_w <= 0:
+            return image.convert('RGB')
+
+        ink = cv2.resize(ink, (barcode_w, barcode_h), interpolation=cv2.INTER_AREA)
+        ink = ink[:self.rng.randint(max(1, int(barcode_h * 0.3)), barcode_h)]
+        ink = self._rotate(ink, self.rng.uniform(*self.barcode_angle))
+        x, y = self.rng.randint(0, image_size[0]), self.rng.randint(0, image_size[1])
+
+        image = np.array(image.convert('RGB'))
+        region = image[y:y + ink.shape[0], x:x + ink.shape[1]]
+        alpha = ink[:region.shape[0], :region.shape[1], None].astype(np.float32) / 255.0
+        region[:] = alpha * color + (1.0 - alpha) * region
+        return Image.fromarray(image)
+
+    def _rotate(self, ink: np.ndarray, angle: float) -> np.ndarray:
+        '''bicubic rotation with the Image.rotate(angle, expand=True) geometry'''
+        matrix, size = masks.rotation((ink.shape[1], ink.shape[0]), angle)
+        return cv2.warpAffine(ink, np.float32(matrix).reshape(2, 3), size,
+                              flags=cv2.INTER_CUBIC | cv2.WARP_INVERSE_MAP, borderValue=0)
 
 
 if __name__ == "__main__":
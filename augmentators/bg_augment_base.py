@@ -1,6 +1,9 @@
+import random
+
+
 class BgAugmentBase():
-    def __init__(self):
-        pass
+    def __init__(self, rng: random.Random = None):
+        self.rng = rng or random
 
     def augment(self):
         pass
@@ -1,19 +1,31 @@
 import os
+import json
 import random
+import metrics
+import numpy as np
+
+import augmentators
 
 from PIL import Image
+from cache import LRUCache
 from typing import List
-from torch import autocast
-from augmentators import *
 from augmentators import BgAugmentBase
-from diffusers import StableDiffusionPipeline
 
 
 class BackgroundGenerator():
     def __init__(self, bg_size: List[int],
-                 use_sd=False, bgs_path: str = None, augments: List[dict] = []) -> None:
+                 use_sd=False, bgs_path: str = None, augments: List[dict] = [],
+                 cache_size_mb: int = 512, preload: bool = False, pool_path: str = None,
+                 rng: random.Random = None) -> None:
         self.bg_size = bg_size
         self.use_sd = use_sd
+        self.rng = rng or random
+        # the background file of the last generated page, None for a blank or stable-diffusion one
+        self.bg_path = None
+        self.cache = LRUCache(cache_size_mb * 2 ** 20, lambda bg: bg.width * bg.height * len(bg.getbands()))
+        self.pool = None
+        self.hits = 0
+        self.misses = 0
         _bgs_formats = ('.png', 'jpg', 'jpeg', 'JPEG', 'jpeg', 'bmp')
 
         if use_sd:
@@ -21,15 +33,81 @@ class BackgroundGenerator():
 
         if bgs_path:
             if os.path.isdir(bgs_path):
-                self.bgs_names = [os.path.join(bgs_path, b) for b in os.listdir(bgs_path) if b.endswith(_bgs_formats)]
+                # sorted, the page draws index this list, os.listdir order differs between file systems
+                self.bgs_names = [os.path.join(bgs_path, b) for b in sorted(os.listdir(bgs_path))
+                                  if b.endswith(_bgs_formats)]
             else:
                 self.bgs_names = [bgs_path]
         else:
             self.bgs_names = []
 
-        self.augments = augments
+        # augments are instantiated once, they keep their caches (e.g. the barcode atlas) between pages
+        self.augments = [getattr(augmentators, name)(**params, rng=self.rng)
+                         for aug in augments for name, params in aug.items()]
+
+        if pool_path and self.bgs_names:
+            self._load_pool(pool_path)
+        elif preload:
+            for bg_path in self.bgs_names:
+                self._load_bg(bg_path)
+
+    def _load_pool(self, pool_path: str) -> None:
+        '''
+        decoded backgrounds resized to bg_size in a (N, h, w, 3) uint8 .npy memory-mapped by all processes,
+        pool_path.json keeps the bg_size and backgrounds it was built for, the pool is rebuilt if they change
+        '''
+        self._pool_index = {bg_path: i for i, bg_path in enumerate(self.bgs_names)}
+        meta = {'bg_size': list(self.bg_size),
+                'bgs': [[b, os.path.getmtime(b)] for b in self.bgs_names]}
+
+        if os.path.exists(pool_path) and os.path.exists(pool_path + '.json'):
+            with open(pool_path + '.json', 'r', encoding='utf-8') as f:
+                if json.load(f) == meta:
+                    self.pool = np.load(pool_path, mmap_mode='r')
+                    return
+
+        pool = np.lib.format.open_memmap(pool_path + '.tmp', mode='w+', dtype=np.uint8,
+                                         shape=(len(self.bgs_names), self.bg_size[1], self.bg_size[0], 3))
+
+        for i, bg_path in enumerate(self.bgs_names):
+            pool[i] = np.array(self._decode(bg_path).convert('RGB'))
+
+        pool.flush()
+        del pool
+        os.replace(pool_path + '.tmp', pool_path)
+
+        with open(pool_path + '.json', 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+
+        self.pool = np.load(pool_path, mmap_mode='r')
+
+    def _decode(self, bg_path: str) -> Image.Image:
+        bg = Image.open(bg_path)
+        return bg.resize(self.bg_size)
+
+    def _load_bg(self, bg_path: str) -> Image.Image:
+        if self.pool is not None and bg_path in self._pool_index:
+            self.hits += 1
+            metrics.count('bg_cache.hits')
+            return Image.fromarray(self.pool[self._pool_index[bg_path]])
+
+        bg = self.cache.get(bg_path)
+
+        if bg is None:
+            self.misses += 1
+            metrics.count('bg_cache.misses')
+            bg = self._decode(bg_path)
+            self.cache.put(bg_path, bg)
+        else:
+            self.hits += 1
+            metrics.count('bg_cache.hits')
+
+        return bg.copy()
 
     def _load_stable_diffusion(self, model_path="CompVis/stable-diffusion-v1-4") -> None:
+        # torch and diffusers take seconds and hundreds of MB to import, only load them for use_sd
+        from diffusers import StableDiffusionPipeline
+
         self.sd_pipe = StableDiffusionPipeline.from_pretrained(model_path,
                                                                use_auth_token=True,
 
@@ -38,19 +116,21 @@ class BackgroundGenerator():
         self.prompt_chars = ' abcdefghijklmnopqrstuvwxyz'
 
     def generate(self, bg_path: str = None, augment: BgAugmentBase = None) -> Image.Image:
+        if not self.use_sd and not bg_path and self.bgs_names:
+            bg_path = self.rng.choice(self.bgs_names)
+
+        self.bg_path = None if self.use_sd else bg_path
+
         if self.use_sd:
-            sd_prompt = ''.join([self.prompt_chars[random.randint(0, len(self.prompt_chars) - 1)] for i in range(15)])
+            from torch import autocast
+
+            sd_prompt = ''.join([self.prompt_chars[self.rng.randint(0, len(self.prompt_chars) - 1)] for i in range(15)])
 
             with autocast('cuda'):
                 bg = self.sd_pipe(sd_prompt, width=self.bg_size[0], height=self.bg_size[1])[0][0]
 
         elif bg_path:
-            bg = Image.open(bg_path)
-            bg = bg.resize(self.bg_size)
-
-        elif self.bgs_names:
-            bg = Image.open(random.choice(self.bgs_names))
-            bg = bg.resize(self.bg_size)
+            bg = self._load_bg(bg_path)
 
         else:
             bg = Image.new(size=self.bg_size, mode='RGB', color=(255, 255, 255))
@@ -59,9 +139,9 @@ class BackgroundGenerator():
             bg = augment.augment(bg)
 
         elif self.augments:
-            for aug in self.augments:
-                aug = globals()[list(aug.keys())[0]](**list(aug.values())[0])
-                bg = aug.augment(bg)
+            with metrics.timer('bg.augment'):
+                for aug in self.augments:
+                    bg = aug.augment(bg)
 
         bg = bg.convert('RGBA')
         return bg
@@ -0,0 +1,277 @@
+import sys
+import copy
+import json
+import time
+import yaml
+import masks
+import random
+import string
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+from typing import Callable, Dict, List
+from paver import Paver, RasterPaver
+
+
+'''
+benchmarks
+
+python benchmark.py paver [--size H W] [--rows N] [--pages N]
+places up to N random rows per page with Paver and the original RasterPaver and prints ms per page
+
+python benchmark.py imports [--module generator] [--max-time S] [--max-rss MB]
+imports the module in a fresh interpreter, fails if the import time or peak RSS is over budget
+or if it loads an optional backend (torch, diffusers, python-barcode, the plotter)
+
+python benchmark.py suite [--config config.yaml] [--out results.json] [--baseline baseline.json] [--threshold 0.2]
+times every generation stage (ms per call) and whole pages (ms per page) at several page and alphabet sizes
+on fixed seeds, writes the results as json, fails if a result is over its baseline by more than threshold
+'''
+
+
+_optional_modules = ['torch', 'diffusers', 'barcode', 'plotter']
+
+_import_probe = '''
+import sys, json, time, resource
+start = time.perf_counter()
+import {module}
+print(json.dumps({{'time': time.perf_counter() - start,
+                  'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                  'modules': sorted(sys.modules)}}))
+'''
+
+
+def bench_paver(paver_cls: type, size: List[int], rows: int, pages: int, seed: int = 0) -> dict:
+    h, w = size
+    placed = 0
+    start = time.perf_counter()
+
+    for page in range(pages):
+        random.seed(seed + page)
+        paver = paver_cls(h, w, page)
+
+        for _ in range(rows):
+            row_h = random.randint(h // 80 + 1, h // 25 + 2)
+            row_w = random.randint(w // 20 + 1, w // 4 + 2)
+
+            if paver.get_random_coords(row_w, row_h) is None:
+                break
+
+            placed += 1
+
+    elapsed = time.perf_counter() - start
+    return {'ms_per_page': elapsed / pages * 1000, 'rows_per_page': placed / pages}
+
+
+def _median_ms(fn: Callable, repeats: int, warmup: int = 2) -> float:
+    for _ in range(warmup):
+        fn()
+
+    times = []
+
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+
+    return statistics.median(times) * 1000
+
+
+def suite_config(config: dict, bg_size: List[int] = None, alphabet_size: int = None,
+                 seed: int = 0, mask_format: str = 'label') -> dict:
+    '''the config with a fixed seed, a single process, FileWriter and mask_format,
+    optionally resized page and alphabet'''
+    config = copy.deepcopy(config)
+    config['Generator'].update({'seed': seed, 'workers': 1, 'writer': {'FileWriter': {}}, 'mask_format': mask_format})
+
+    if bg_size:
+        config['BackgroundGenerator']['bg_size'] = list(bg_size)
+
+    if alphabet_size:
+        chars = config['Generator']['alphabet'] + string.ascii_letters + string.digits
+        chars += ''.join(chr(c) for c in range(0xc0, 0x250))
+        alphabet = ''.join(dict.fromkeys(chars))
+        config['Generator']['alphabet'] = alphabet[:alphabet_size]
+
+    return config
+
+
+def bench_stages(config: dict, repeats: int = 20, seed: int = 0, mask_format: str = 'label') -> Dict[str, float]:
+    '''median ms per call of every generation stage'''
+    from generator import Generator
+    from plotter import Plotter
+
+    results = {}
+
+    with tempfile.TemporaryDirectory() as save_path:
+        config = suite_config(config, seed=seed, mask_format=mask_format)
+        config['Generator']['save_path'] = save_path
+        generator = Generator(config)
+        rows = generator.crop_generator
+        bg_w, bg_h = config['BackgroundGenerator']['bg_size']
+
+        generator.rng.seed(seed)
+        results['bg'] = _median_ms(generator.bg_generator.generate, repeats)
+
+        generator.rng.seed(seed)
+        results['row'] = _median_ms(rows.generate, repeats)
+
+        generator.rng.seed(seed)
+        grids = [rows.generate()[1] for _ in range(repeats)]
+        char_mask = masks.new_mask(len(generator.alphabet) + 1, bg_h, bg_w, generator.mask_format)
+        angles = iter(lambda: generator.rng.uniform(*generator.row_angle), None)
+        crops = iter(grids * 3)
+        results['rotation'] = _median_ms(lambda: generator._paste_grid_mask(next(crops), next(angles),
+                                                                            (0, 0), char_mask), repeats)
+
+        results['paver'] = bench_paver(Paver, [bg_h, bg_w], 100, repeats, seed)['ms_per_page']
+
+        generator.rng.seed(seed)
+        results['table'] = _median_ms(generator.table_generator.generate, repeats)
+
+        page = generator.render_page(0)
+        names = iter(range(repeats + 2))
+        results['saving'] = _median_ms(lambda: generator.writer.write(next(names), generator._encode_page(page)),
+                                       repeats)
+
+        plotter = Plotter(save_path)
+        results['plotter'] = _median_ms(lambda: plotter.plot(filename='0'), repeats)
+        results['reader'] = _median_ms(lambda: plotter.reader.batch(range(len(plotter.reader)),
+                                                                    ['row_coords', 'char_mask']), repeats)
+
+        # the vector annotation of the same page rasterized back to a full resolution label map
+        generator.annotation = 'vector'
+        annotation = generator.render_page(0)['annotation']
+        results['rasterize'] = _median_ms(lambda: masks.rasterize(annotation['char_codes'], annotation['char_quads'],
+                                                                  annotation['size'], len(generator.alphabet) + 1),
+                                          repeats)
+
+    return results
+
+
+def bench_pages(config: dict, bg_sizes: List[List[int]], alphabet_sizes: List[int],
+                pages: int = 10, seed: int = 0, mask_format: str = 'label') -> Dict[str, float]:
+    '''ms per rendered and encoded page for every page size (w, h) and alphabet size'''
+    from generator import Generator
+
+    results = {}
+
+    with tempfile.TemporaryDirectory() as save_path:
+        for bg_size in bg_sizes:
+            for alphabet_size in alphabet_sizes:
+                page_config = suite_config(config, bg_size, alphabet_size, seed, mask_format)
+                page_config['Generator']['save_path'] = save_path
+                generator = Generator(page_config)
+                indices = iter(range(pages + 2))
+                key = f'page_{bg_size[0]}x{bg_size[1]}_alphabet_{alphabet_size}'
+                results[key] = _median_ms(lambda: generator._encode_page(generator.render_page(next(indices))),
+                                          pages)
+
+    return results
+
+
+def check_baseline(results: Dict[str, float], baseline: Dict[str, float], threshold: float = 0.2) -> List[str]:
+    '''returns the results slower than their baseline by more than threshold (a fraction)'''
+    errors = []
+
+    for key, value in results.items():
+        if key in baseline and value > baseline[key] * (1 + threshold):
+            errors.append(f'{key}: {value:.2f}ms, baseline {baseline[key]:.2f}ms (+{value / baseline[key] - 1:.0%})')
+
+    return errors
+
+
+def bench_imports(module: str = 'generator') -> dict:
+    out = subprocess.run([sys.executable, '-c', _import_probe.format(module=module)],
+                         capture_output=True, text=True, check=True).stdout
+    result = json.loads(out)
+    loaded = set(result.pop('modules'))
+    result['optional_loaded'] = [m for m in _optional_modules if m in loaded]
+    return result
+
+
+def check_imports(result: dict, max_time: float = 1.0, max_rss: float = 150) -> List[str]:
+    '''returns budget violations of a bench_imports result, empty if it is within budget'''
+    errors = []
+
+    if result['time'] > max_time:
+        errors.append(f'import took {result["time"]:.2f}s, budget {max_time:.2f}s')
+
+    if result['rss_mb'] > max_rss:
+        errors.append(f'import peak RSS {result["rss_mb"]:.0f}MB, budget {max_rss:.0f}MB')
+
+    if result['optional_loaded']:
+        errors.append(f'import loaded optional backends: {", ".join(result["optional_loaded"])}')
+
+    return errors
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='bench', required=True)
+    paver_parser = subparsers.add_parser('paver', help='Paver vs RasterPaver on dense pages')
+    paver_parser.add_argument('--size', type=int, nargs=2, default=[3508, 2480], help='Page size (h, w)')
+    paver_parser.add_argument('--rows', type=int, default=100, help='Rows to place on each page')
+    paver_parser.add_argument('--pages', type=int, default=5, help='Pages to place')
+    imports_parser = subparsers.add_parser('imports', help='Import time and RSS budget')
+    imports_parser.add_argument('--module', type=str, default='generator', help='Module to import')
+    imports_parser.add_argument('--max-time', type=float, default=1.0, help='Import time budget, s')
+    imports_parser.add_argument('--max-rss', type=float, default=150, help='Peak RSS budget, MB')
+    suite_parser = subparsers.add_parser('suite', help='Per stage and per page times against a baseline')
+    suite_parser.add_argument('--config', type=str, default='config.yaml', help='Config file')
+    suite_parser.add_argument('--repeats', type=int, default=20, help='Timed calls of every stage')
+    suite_parser.add_argument('--pages', type=int, default=10, help='Timed pages of every page and alphabet size')
+    suite_parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 312, 1240, 1754],
+                              help='Page sizes, pairs of w h')
+    suite_parser.add_argument('--alphabets', type=int, nargs='+', default=[10, 76, 300], help='Alphabet sizes')
+    suite_parser.add_argument('--mask-format', type=str, default='label',
+                              help='Mask format of every stage, onehot pages of large alphabets take GBs')
+    suite_parser.add_argument('--seed', type=int, default=0, help='Seed of every stage')
+    suite_parser.add_argument('--out', type=str, default=None, help='Results json file')
+    suite_parser.add_argument('--baseline', type=str, default=None, help='Baseline results json file')
+    suite_parser.add_argument('--threshold', type=float, default=0.2, help='Allowed slowdown over the baseline')
+    args = parser.parse_args()
+
+    if args.bench == 'paver':
+        for paver_cls in (RasterPaver, Paver):
+            result = bench_paver(paver_cls, args.size, args.rows, args.pages)
+            print(f'{paver_cls.__name__:12} {result["ms_per_page"]:10.1f} ms/page '
+                  f'{result["rows_per_page"]:6.1f} rows/page')
+
+    elif args.bench == 'imports':
+        result = bench_imports(args.module)
+        print(f'import {args.module}: {result["time"]:.3f}s, peak RSS {result["rss_mb"]:.0f}MB')
+        errors = check_imports(result, args.max_time, args.max_rss)
+
+        for error in errors:
+            print(error)
+
+        sys.exit(1 if errors else 0)
+
+    elif args.bench == 'suite':
+        with open(args.config) as f:
+            config = yaml.safe_load(f)
+
+        sizes = [args.sizes[i:i + 2] for i in range(0, len(args.sizes) - 1, 2)]
+        results = bench_stages(config, args.repeats, args.seed, args.mask_format)
+        results.update(bench_pages(config, sizes, args.alphabets, args.pages, args.seed, args.mask_format))
+
+        for key, value in results.items():
+            print(f'{key:32} {value:10.2f} ms')
+
+        if args.out:
+            with open(args.out, 'w') as f:
+                json.dump(results, f, indent=4)
+
+        errors = []
+
+        if args.baseline:
+            with open(args.baseline) as f:
+                errors = check_baseline(results, json.load(f), args.threshold)
+
+        for error in errors:
+            print(error)
+
+        sys.exit(1 if errors else 0)
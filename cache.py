@@ -0,0 +1,42 @@
+from collections import OrderedDict
+from typing import Callable, Hashable
+
+
+class LRUCache():
+    '''
+    LRUCache(max_size, sizeof)
+    least recently used items are evicted while the total size is over max_size,
+    an item size is sizeof(item), 1 by default
+    '''
+
+    def __init__(self, max_size: int, sizeof: Callable = None) -> None:
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self.items = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable):
+        item = self.items.get(key)
+
+        if item is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.items.move_to_end(key)
+
+        return item
+
+    def put(self, key: Hashable, item) -> None:
+        if key in self.items:
+            self.size -= self._sizeof(self.items.pop(key))
+
+        self.items[key] = item
+        self.size += self._sizeof(item)
+
+        while self.size > self.max_size and self.items:
+            self.size -= self._sizeof(self.items.popitem(last=False)[1])
+
+    def _sizeof(self, item) -> int:
+        return self.sizeof(item) if self.sizeof else 1
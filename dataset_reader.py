@@ -0,0 +1,186 @@
+import os
+import cv2
+import json
+import numpy as np
+
+from typing import Dict, Iterable, List
+from concurrent.futures import ThreadPoolExecutor
+from writers import FileWriter, ShardReader, RecipeReader, decode_member, read_manifest
+
+
+'''
+DatasetReader(data_path)
+random access to the pages of a generated folder, written by FileWriter, ShardWriter or RecipeWriter
+
+reader[i]               Sample of the i-th page (pages sorted by name), fields are read on first access
+reader.read(name, f)    a field of page "name":
+    image               (H, W, 3) uint8 RGB
+    row_coords          dict
+    char_mask, field_mask, char_mask_full, field_mask_full
+                        arrays memory-mapped from .npy files and uncompressed shard members,
+                        a read touches only the pages of the mask it uses, repeated reads hit the page cache
+    annotation          {name: array} of a vector annotated page
+reader.fields(name)     the fields a page has
+reader.index[name]      the position of page "name"
+reader.batch(indices, fields, threads)
+                        samples of many pages, read in storage order (by shard offset) on threads
+
+pages of a RecipeWriter folder are rendered again on read, the last one is kept
+'''
+
+
+class Sample():
+    '''lazy page fields: sample['row_coords'] reads only the row coords'''
+
+    def __init__(self, reader: 'DatasetReader', name: int) -> None:
+        self.reader = reader
+        self.name = name
+        self.loaded = {}
+
+    def __getitem__(self, field: str):
+        if field not in self.loaded:
+            self.loaded[field] = self.reader.read(self.name, field)
+
+        return self.loaded[field]
+
+    def __contains__(self, field: str) -> bool:
+        return field in self.keys()
+
+    def keys(self) -> List[str]:
+        return self.reader.fields(self.name)
+
+
+class DatasetReader():
+    members = {'image': 'png', 'row_coords': 'json', 'annotation': 'annotation.npz'}
+
+    def __init__(self, data_path: str) -> None:
+        self.data_path = data_path
+        self.shards = None
+        self.recipes = None
+        self._page = (None, None)
+
+        if os.path.isdir(os.path.join(data_path, 'shards')):
+            self.shards = ShardReader(data_path)
+            names = self.shards.names
+        elif os.path.exists(os.path.join(data_path, 'recipes.jsonl')):
+            self.recipes = RecipeReader(data_path)
+            names = self.recipes.names
+        elif os.path.exists(os.path.join(data_path, 'manifest.jsonl')):
+            names = read_manifest(data_path)
+        else:
+            imgs_path = os.path.join(data_path, FileWriter.subfolders['png'])
+            names = [int(f[:-len('.png')]) for f in os.listdir(imgs_path) if f.endswith('.png') and f[:-4].isdigit()]
+
+        self.names = sorted(set(names))
+        self.index = {name: i for i, name in enumerate(self.names)}
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __getitem__(self, i: int) -> Sample:
+        return Sample(self, self.names[i])
+
+    def sample(self, name: int) -> Sample:
+        return Sample(self, name)
+
+    def fields(self, name: int) -> List[str]:
+        if self.shards:
+            return [self._field(member) for member in self.shards.members(name)]
+
+        if self.recipes:
+            return [field for field in self._render(name) if field != 'recipe']
+
+        return [self._field(member) for member in FileWriter.subfolders if os.path.exists(self._path(name, member))]
+
+    def read(self, name: int, field: str):
+        if self.recipes:
+            return self._recipe_field(name, field)
+
+        member = self.members.get(field, f'{field}.npy')
+
+        if self.shards:
+            # a mask of a compressed shard is stored as .npz
+            member = self.shards.member(name, member.rsplit('.', 1)[0] if member.endswith('.npy') else member)
+            tar_path, offset, size = self.shards.locate(name, member)
+
+            if member.endswith('.npy'):
+                return _memmap_npy(tar_path, offset)
+
+            return self._decode(member, self.shards.read(name, member))
+
+        path = self._path(name, member)
+
+        if member.endswith('.npy'):
+            return np.load(path, mmap_mode='r')
+
+        with open(path, 'rb') as f:
+            return self._decode(member, f.read())
+
+    def batch(self, indices: Iterable[int], fields: List[str] = None, threads: int = 1) -> List[Dict[str, object]]:
+        '''{field: value} of the pages at indices, all fields of every page if fields is None'''
+        names = [self.names[i] for i in indices]
+        # one pass over the storage: pages sorted by shard and offset, or by name
+        order = sorted(set(names), key=self._location)
+
+        def read(name: int) -> Dict[str, object]:
+            return {field: self.read(name, field) for field in fields or self.fields(name)}
+
+        if threads > 1 and not self.recipes:
+            with ThreadPoolExecutor(threads) as pool:
+                pages = dict(zip(order, pool.map(read, order)))
+        else:
+            pages = {name: read(name) for name in order}
+
+        return [pages[name] for name in names]
+
+    def _location(self, name: int) -> tuple:
+        if self.shards:
+            tar_path, members = self.shards.samples[name]
+            return tar_path, min(offset for offset, _ in members.values())
+
+        return '', name
+
+    def _field(self, member: str) -> str:
+        for field, stored in self.members.items():
+            if member == stored:
+                return field
+
+        return member.rsplit('.', 1)[0]
+
+    def _path(self, name: int, member: str) -> str:
+        return os.path.join(self.data_path, FileWriter.subfolders[member], f'{name}.{member.split(".")[-1]}')
+
+    def _decode(self, member: str, data: bytes):
+        if member == 'png':
+            return cv2.cvtColor(cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR), cv2.COLOR_BGR2RGB)
+
+        if member == 'json':
+            return json.loads(data.decode('utf-8'))
+
+        return decode_member(member, data)
+
+    def _render(self, name: int) -> dict:
+        if self._page[0] != name:
+            self._page = (name, self.recipes.load(name))
+
+        return self._page[1]
+
+    def _recipe_field(self, name: int, field: str):
+        value = self._render(name)[field]
+        return np.array(value) if field == 'image' else value
+
+
+def _memmap_npy(path: str, offset: int) -> np.ndarray:
+    '''the array of a .npy stored at offset of a file, memory-mapped'''
+    with open(path, 'rb') as f:
+        f.seek(offset)
+
+        if np.lib.format.read_magic(f) == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+
+        data_offset = f.tell()
+
+    return np.memmap(path, dtype=dtype, mode='r', offset=data_offset, shape=shape,
+                     order='F' if fortran_order else 'C')
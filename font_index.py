@@ -0,0 +1,125 @@
+import os
+import json
+
+from PIL import ImageFont
+from typing import Dict, List
+from concurrent.futures import ProcessPoolExecutor
+
+
+'''
+FontIndex(font_paths, alphabet, index_path, workers)
+preflight scan of the fonts: which alphabet chars every font really draws, and its metrics
+
+a char is covered if it has ink and its glyph is not the .notdef (tofu) glyph of the font,
+.notdef is drawn for a code point no font maps; a font that fails to load covers nothing
+
+index_path is a json {"alphabet": ..., "fonts": {path: entry}}, entry:
+    size, mtime  - of the font file, the font is scanned again if they change
+    missing      - alphabet chars the font can not draw
+    ascent, descent, error
+only new and changed fonts are scanned, on a process pool of workers (all cpus by default),
+so a restart with an unchanged fonts folder only reads the index
+'''
+
+
+_notdef_probe = '\U0010fffd'
+
+
+class FontIndex():
+    def __init__(self, font_paths: List[str], alphabet: str, index_path: str, workers: int = None) -> None:
+        self.alphabet = alphabet
+        self.index_path = index_path
+        self.fonts = {}
+        index = self._load()
+        todo = []
+
+        for path in font_paths:
+            entry = index.get(path)
+
+            if entry and entry['size'] == os.path.getsize(path) and entry['mtime'] == os.path.getmtime(path):
+                self.fonts[path] = entry
+            else:
+                todo.append(path)
+
+        if todo:
+            workers = min(workers or os.cpu_count() or 1, len(todo))
+
+            if workers > 1:
+                with ProcessPoolExecutor(workers) as pool:
+                    scanned = list(pool.map(_scan_font, todo, [alphabet] * len(todo), chunksize=4))
+            else:
+                scanned = [_scan_font(path, alphabet) for path in todo]
+
+            self.fonts.update(zip(todo, scanned))
+
+        if todo or len(self.fonts) != len(index):
+            self._save()
+
+        # missing chars as sets, for the per row coverage checks
+        self.missing = {path: frozenset(entry['missing']) for path, entry in self.fonts.items()}
+        self.any_missing = frozenset().union(*self.missing.values())
+
+    def usable(self) -> List[str]:
+        '''fonts that load and draw at least one alphabet char'''
+        return [path for path, entry in self.fonts.items()
+                if not entry['error'] and len(entry['missing']) < len(self.alphabet)]
+
+    def draws(self, font_paths: List[str], text: str) -> bool:
+        '''one of font_paths draws every char of text, fonts out of the index are taken to draw everything'''
+        chars = frozenset(text)
+        return not chars & self.any_missing or any(not chars & self.missing.get(path, frozenset())
+                                                   for path in font_paths)
+
+    def covering(self, font_paths: List[str], text: str) -> List[str]:
+        '''font_paths that draw every char of text, the ones missing the fewest chars if none does'''
+        chars = frozenset(text)
+
+        if not chars & self.any_missing:
+            return font_paths
+
+        missing = [len(chars & self.missing[path]) for path in font_paths]
+        fewest = min(missing, default=0)
+        return [path for path, n in zip(font_paths, missing) if n == fewest]
+
+    def _load(self) -> Dict[str, dict]:
+        if not os.path.exists(self.index_path):
+            return {}
+
+        with open(self.index_path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+
+        return index['fonts'] if index.get('alphabet') == self.alphabet else {}
+
+    def _save(self) -> None:
+        os.makedirs(os.path.dirname(self.index_path) or '.', exist_ok=True)
+
+        with open(self.index_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'alphabet': self.alphabet, 'fonts': self.fonts}, f, ensure_ascii=False)
+
+        os.replace(self.index_path + '.tmp', self.index_path)
+
+
+def _scan_font(path: str, alphabet: str, font_size: int = 50) -> dict:
+    entry = {'size': os.path.getsize(path), 'mtime': os.path.getmtime(path)}
+
+    try:
+        font = ImageFont.truetype(path, size=font_size)
+        notdef = font.getmask(_notdef_probe)
+        notdef = (notdef.size, bytes(notdef))
+        missing = []
+
+        for char in alphabet:
+            if char.isspace():
+                continue
+
+            mask = font.getmask(char)
+
+            if mask.getbbox() is None or (mask.size, bytes(mask)) == notdef:
+                missing.append(char)
+
+        ascent, descent = font.getmetrics()
+        entry.update(missing=''.join(missing), ascent=ascent, descent=descent, error=None)
+    except Exception as e:
+        entry.update(missing=alphabet, ascent=0, descent=0, error=repr(e))
+
+    return entry
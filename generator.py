@@ -1,14 +1,20 @@
-import os
-import json
+import time
 import random
+import masks
+import metrics
 import numpy as np
 
-from copy import copy
 from PIL import Image
 from tqdm import tqdm
 from paver import Paver
-from typing import Tuple
-from row_generator import RowGenerator
+from writers import *
+from collections import deque
+from itertools import count, islice
+from typing import Dict, Iterator, List, Tuple, Union
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from row_bank import RowBank, BankRow
+from row_generator import RowGenerator, RowLayout
 from table_generator import TableGenerator
 from background_generator import BackgroundGenerator
 
@@ -16,110 +22,451 @@ from background_generator import BackgroundGenerator
 class Generator():
     def __init__(self, config: dict) -> None:
         self.num_imgs = config['Generator']['num_imgs']
+        self.workers = config['Generator'].get('workers', 1)
+        self.seed = config['Generator'].get('seed')
+
+        if self.seed is None:
+            self.seed = random.SystemRandom().randrange(2 ** 32)
+
+        self.config = {**config, 'Generator': {**config['Generator'], 'seed': self.seed}}
         save_path = config['Generator']['save_path']
         self.alphabet = config['Generator']['alphabet']
         self.row_angle = config['Generator']['row_angle']
         self.words_in_page = config['Generator']['words_in_page']
-        self.bg_generator = BackgroundGenerator(**config['BackgroundGenerator'])
-        self.crop_generator = RowGenerator(**config['RowGenerator'], alphabet=self.alphabet)
+        self.mask_format = config['Generator'].get('mask_format', 'onehot')
+        self.mask_stride = config['Generator'].get('mask_stride', 1)
+        self.stride_mode = config['Generator'].get('stride_mode', 'majority')
+        self.keep_full_masks = config['Generator'].get('keep_full_masks', False)
+        self.annotation = config['Generator'].get('annotation', 'raster')
+
+        if self.annotation not in ('raster', 'vector', 'both'):
+            raise ValueError(f'annotation must be one of raster, vector, both, got {self.annotation}')
+
+        if self.stride_mode not in masks.STRIDE_MODES:
+            raise ValueError(f'stride_mode must be one of {masks.STRIDE_MODES}, got {self.stride_mode}')
+
+        # rows shrunk and shortened to the space left before they are drawn, pages filled to fill_density
+        self.fit_rows = config['Generator'].get('fit_rows', False)
+        self.fill_density = config['Generator'].get('fill_density')
+        self.fill_attempts = config['Generator'].get('fill_attempts', 10)
+
+        # every draw of a page comes from this stream, shared by all page components and reseeded by
+        # (seed, page index), so pages do not depend on other users of the random module
+        self.rng = random.Random()
+        self.bg_generator = BackgroundGenerator(**config['BackgroundGenerator'], rng=self.rng)
+        self.crop_generator = RowGenerator(**config['RowGenerator'], alphabet=self.alphabet,
+                                           mask_format=self.mask_format, rng=self.rng)
         self.table_generator = TableGenerator(**config['TableGenerator'],
                                               text_generator=self.crop_generator,
-                                              size_range=config['RowGenerator']['font_size'])
-        self.save_subfolders = ['images', 'field_masks', 'char_masks', 'row_coords']
+                                              size_range=config['RowGenerator']['font_size'], rng=self.rng)
+        # [optional] rows are sampled from a pre-rendered RowBank instead of rendered per page
+        self.row_bank = None
 
-        for i in range(len(self.save_subfolders)):
-            subfolder = os.path.join(save_path, self.save_subfolders[i])
-            self.save_subfolders[i] = subfolder
-            if not os.path.exists(subfolder):
-                os.mkdir(subfolder)
+        if config.get('RowBank'):
+            self.row_bank = RowBank(**config['RowBank'], row_config=config['RowGenerator'], alphabet=self.alphabet,
+                                    seed=self.seed, mask_format=self.mask_format, rng=self.rng)
 
-    def _paste_grid_mask(self, grid_crop: np.ndarray,
-                         angle: float, left_top: Tuple[int, int], char_mask: np.ndarray) -> np.ndarray:
-        for i in range(grid_crop.shape[0]):
-            layer = Image.fromarray(grid_crop[i] * 255)
-            layer = layer.convert('RGBA')
-            layer = layer.rotate(angle, expand=True, resample=Image.BICUBIC)
+        self.rows = self.row_bank or self.crop_generator
+        writer = config['Generator'].get('writer', {'FileWriter': {}})
+        self.writer = globals()[list(writer.keys())[0]](**list(writer.values())[0], save_path=save_path)
+
+        # a recipe writer stores only the resolved choices, pages are rendered without masks and annotations
+        self.recipes_only = isinstance(getattr(self.writer, 'writer', self.writer), RecipeWriter)
 
-            if i == 0:
-                back = Image.new('RGBA', layer.size, (255,) * 4)
-            else:
-                back = Image.new('RGBA', layer.size, (0,) * 4)
+        if self.recipes_only and self.bg_generator.use_sd:
+            raise ValueError('stable-diffusion backgrounds can not be rebuilt from a recipe')
 
-            layer = Image.composite(layer, back, layer)
-            layer = layer.convert('1')
-            char_mask[i, left_top[1]:left_top[1] + layer.size[1],
-                      left_top[0]:left_top[0] + layer.size[0]] = np.array(layer)
+        # [optional] {SinkName: {param: value}}, enables metrics
+        # or metrics.enable() and set metrics_sink to any object with write(record) and close()
+        self.metrics_sink = None
+        self.metrics = metrics.Metrics()
+        metrics_sink = config['Generator'].get('metrics')
 
-        return char_mask
+        if metrics_sink:
+            metrics.enable()
+            self.metrics_sink = getattr(metrics, list(metrics_sink.keys())[0])(**list(metrics_sink.values())[0])
+
+    def _paste_grid_mask(self, grid_crop: np.ndarray,
+                         angle: float, left_top: Tuple[int, int], char_mask: np.ndarray) -> np.ndarray:
+        return masks.paste(char_mask, masks.rotate(grid_crop, angle), left_top)
 
     def _paste_field_mask(self, field_mask: np.ndarray, left_top: Tuple[int, int],
                           field_size: Tuple[int, int], angle: float, field_code: int) -> Tuple[np.ndarray, tuple]:
-        field = Image.new('RGBA', (field_size[1], field_size[0]), 1)
-        layer = Image.new('1', (field_mask.shape[2], field_mask.shape[1]), 0)
-        field = field.rotate(angle, expand=True, resample=Image.BICUBIC)
-        back = Image.new('RGBA', field.size, (255,) * 4)
-        field = Image.composite(field, back, field)
-        field = field.convert('1')
-        layer.paste(field, left_top)
-        layer = np.array(layer)
-        field_mask[0] -= layer
-        field_mask[field_code + 1] += layer
-        return field_mask, field.size
-
-    def generate(self) -> None:
-        imgs_path = self.save_subfolders[0]
-        exists_imgs = [f.replace('.png', '') for f in os.listdir(imgs_path) if f.endswith('png')]
-        exists_imgs = [int(n) for n in exists_imgs if n.isdigit()]
-        first_name = max(exists_imgs) + 1 if exists_imgs else 0
-
-        for i in tqdm(range(0, self.num_imgs)):
+        # a field covers the bounding box of its rotated row
+        w, h = masks.rotated_size((field_size[1], field_size[0]), angle)
+        field_mask = masks.fill_rect(field_mask, field_code + 1, left_top[0], left_top[1],
+                                     left_top[0] + w - 1, left_top[1] + h - 1)
+        return field_mask, (w, h)
+
+    def _row_points(self, layout: Union[RowLayout, BankRow], angle: float, left_top: Tuple[int, int],
+                    points: np.ndarray) -> np.ndarray:
+        '''(..., 2) points of a row crop to page coords, the row rotated by angle and placed at left_top'''
+        (a, b, c, d, e, f), _ = masks.rotation(layout.size, angle)
+        det = a * e - b * d
+        x, y = points[..., 0] - c, points[..., 1] - f
+        return np.stack([left_top[0] + (e * x - b * y) / det, left_top[1] + (a * y - d * x) / det], axis=-1)
+
+    def _row_char_centers(self, layout: Union[RowLayout, BankRow], angle: float,
+                          left_top: Tuple[int, int]) -> Iterator[Tuple[int, float, float]]:
+        '''(char code, x, y) of the char box centers of a row rotated by angle and placed at left_top'''
+        centers = list(self.rows.char_centers(layout))
+        points = self._row_points(layout, angle, left_top, np.array([c[1:] for c in centers]).reshape(-1, 2))
+
+        for (code, _, _), (x, y) in zip(centers, points):
+            yield code, x, y
+
+    def _annotation(self, size: List[int], chars: list, fields: list) -> Dict[str, np.ndarray]:
+        '''vector annotation of a page, quads are (4, 2) page pixel coords clockwise from the row left top'''
+        return {'size': np.array(size, dtype=np.int32),
+                'char_codes': np.array([code for code, _ in chars], dtype=masks.label_dtype(len(self.alphabet) + 1)),
+                'char_quads': np.array([quad for _, quad in chars], dtype=np.float32).reshape(-1, 4, 2),
+                'field_codes': np.array([code for code, _ in fields], dtype=np.uint8),
+                'field_quads': np.array([quad for _, quad in fields], dtype=np.float32).reshape(-1, 4, 2)}
+
+    def _strided_masks(self, page: dict, centers: list) -> dict:
+        '''masks at mask_stride, the char mask from the char centers in the center mode'''
+        cm, fm = page['char_mask'], page['field_mask']
+        strided = {'field_mask': masks.downsample(fm, self.mask_stride, self.stride_mode)}
+
+        if self.stride_mode == 'center':
+            h, w = masks.strided_size(cm.shape[-2:], self.mask_stride)
+            strided['char_mask'] = masks.new_mask(len(self.alphabet) + 1, h, w, self.mask_format)
+
+            for code, x, y in centers:
+                x, y = int(x // self.mask_stride), int(y // self.mask_stride)
+
+                if 0 <= x < w and 0 <= y < h:
+                    masks.fill_rect(strided['char_mask'], code, x, y, x, y)
+        else:
+            strided['char_mask'] = masks.downsample(cm, self.mask_stride, 'majority')
+
+        if self.keep_full_masks:
+            strided.update({'field_mask_full': fm, 'char_mask_full': cm})
+
+        return {**page, **strided}
+
+    def _fit_row(self, paver: Paver, layout: Union[RowLayout, BankRow],
+                 angle: float) -> Union[RowLayout, BankRow, None]:
+        '''the layout scaled down, then shortened, to fit the free space of the page, None if it can not
+        a bank row is only scaled, its text is already rendered'''
+        w, h = masks.rotated_size(layout.size, angle)
+
+        if paver.fits(w, h):
+            return layout
+
+        # 2 px of margin for the rounding of the rotated size
+        layout = self.rows.resized(layout, paver.max_scale(w + 2, h + 2))
+        w, h = masks.rotated_size(layout.size, angle)
+        metrics.count('row.resized')
+
+        if paver.fits(w, h):
+            return layout
+
+        if self.row_bank:
+            return None
+
+        # too long at the min font size, the rotation adds w - row w to the width
+        layout = self.crop_generator.shortened(layout, paver.max_width(h) - (w - layout.size[0]) - 2)
+        metrics.count('row.shortened')
+
+        if layout is None or not paver.fits(*masks.rotated_size(layout.size, angle)):
+            return None
+
+        return layout
+
+    def _seed_page(self, index: int) -> None:
+        self.rng.seed(f'{self.seed}:{index}')
+
+    def render_page(self, index: int, annotate: bool = True) -> dict:
+        '''the page of index, without masks and vector annotation if not annotate (same draws and image)'''
+        self._seed_page(index)
+
+        with metrics.timer('page.bg'):
             bg = self.bg_generator.generate()
-            cm = np.zeros((len(self.alphabet) + 1, bg.size[1], bg.size[0]))
-            cm[0] = cm[0] + 1
-            fm = np.zeros((2, bg.size[1], bg.size[0]))
-            fm[0] = fm[0] + 1
-            size = list(bg.size)
-            size.reverse()
-            paver = Paver(*size, i)
-            row_coords = []
-            max_words = random.randint(*self.words_in_page)
-            words_count = -1
-
-            table, tgrid, tdata = self.table_generator.generate()
-            tcoords = paver.get_random_coords(*table.size)
-            cm = self._paste_grid_mask(tgrid, 0, tcoords, copy(cm))
+
+        raster = annotate and self.annotation != 'vector'
+        vector = annotate and self.annotation != 'raster'
+        cm, fm = None, None
+
+        if raster:
+            cm = masks.new_mask(len(self.alphabet) + 1, bg.size[1], bg.size[0], self.mask_format)
+            fm = masks.new_mask(2, bg.size[1], bg.size[0], self.mask_format)
+
+        size = list(bg.size)
+        size.reverse()
+        paver = Paver(*size, index, rng=self.rng)
+        row_coords = []
+        max_words = self.rng.randint(*self.words_in_page)
+        centers = []
+        collect_centers = raster and self.mask_stride > 1 and self.stride_mode == 'center'
+        # vector annotation: (code, (4, 2) quad) of every char and field
+        chars, fields = [], []
+        # the resolved choices of the page, RecipeWriter stores them to check rebuilt pages
+        recipe = {'seed': self.seed, 'background': self.bg_generator.bg_path, 'rows': [], 'table': None}
+
+        with metrics.timer('page.table'):
+            tlayout = self.table_generator.layout()
+            tcoords = paver.get_random_coords(*tlayout.size)
 
             if tcoords:
+                if raster:
+                    table, cm = self.table_generator.render(tlayout, cm, tcoords)
+                else:
+                    table, _ = self.table_generator.render(tlayout, with_mask=False)
+
                 bg.paste(table, tcoords, table)
 
-            while True:
-                words_count += 1
-                text_crop, grid_crop, text = self.crop_generator.generate()
-                fmm = copy(fm)
-                cmm = copy(cm)
-                angle = random.uniform(*self.row_angle)
-                text_crop = text_crop.rotate(angle, expand=True, resample=Image.BICUBIC)
-                coords = paver.get_random_coords(*text_crop.size)
+                if collect_centers:
+                    centers.extend(self.table_generator.char_centers(tlayout, tcoords))
+
+                if vector:
+                    boxes = list(self.table_generator.char_boxes(tlayout, tcoords))
+                    chars.extend(zip([box[0] for box in boxes], masks.box_quads([box[1:] for box in boxes])))
 
-                if coords is None or words_count == max_words:
+        misses = 0
+
+        while len(row_coords) < max_words:
+            if self.fill_density and paver.density() >= self.fill_density:
+                break
+
+            layout = self.row_bank.layout(index) if self.row_bank else self.crop_generator.layout()
+            angle = self.rng.uniform(*self.row_angle)
+
+            if self.fit_rows:
+                layout = self._fit_row(paver, layout, angle)
+
+            coords = paver.get_random_coords(*masks.rotated_size(layout.size, angle)) if layout else None
+
+            if coords is None:
+                metrics.count('page.row_misses')
+                misses += 1
+
+                # without a density target the page is full at the first row that does not fit
+                if not self.fill_density or misses >= self.fill_attempts:
                     break
 
+                continue
+
+            misses = 0
+
+            text_crop, grid_crop = self.rows.render(layout, with_mask=raster)
+
+            with metrics.timer('row.paste'):
+                text_crop = text_crop.rotate(angle, expand=True, resample=Image.BICUBIC)
                 bg.paste(text_crop, coords, text_crop)
-                cm = self._paste_grid_mask(np.array(grid_crop), angle, coords, cmm)
-                fm, rotate_field_size = self._paste_field_mask(fmm, coords, grid_crop.shape[1:], angle, 0)
-                row_coords.append({'left_top': [int(c) for c in coords],
-                                   'size': [rotate_field_size[1], rotate_field_size[0]],
-                                   'text': text})
-
-            bg = bg.convert('RGB')
-            name = first_name + i
-            bg.save(os.path.join(self.save_subfolders[0], f'{name}.png'))
-            np.save(os.path.join(self.save_subfolders[1], f'{name}.npy'), fm)
-            np.save(os.path.join(self.save_subfolders[2], f'{name}.npy'), cm)
+                rotate_field_size = masks.rotated_size(layout.size, angle)
+
+                if raster:
+                    cm = self._paste_grid_mask(grid_crop, angle, coords, cm)
+                    fm, rotate_field_size = self._paste_field_mask(fm, coords, grid_crop.shape[-2:], angle, 0)
+
+            if collect_centers:
+                centers.extend(self._row_char_centers(layout, angle, coords))
+
+            if vector:
+                boxes = list(self.rows.char_boxes(layout))
+                quads = self._row_points(layout, angle, coords, masks.box_quads([box[1:] for box in boxes]))
+                chars.extend(zip([box[0] for box in boxes], quads))
+                # a field covers the bounding box of its rotated row, as in the raster field mask
+                fields.append((1, masks.box_quads([coords[0], coords[1], coords[0] + rotate_field_size[0],
+                                                   coords[1] + rotate_field_size[1]])[0]))
 
+            recipe['rows'].append([layout.font_path, layout.text])
+            row_coords.append({'left_top': [int(c) for c in coords],
+                               'size': [rotate_field_size[1], rotate_field_size[0]],
+                               'text': layout.text})
+
+        metrics.count('page.rows', len(row_coords))
+        metrics.count('page.words_in_page', max_words)
+        metrics.gauge('page.density', paver.density())
+
+        if raster:
+            metrics.gauge('mask_bytes', cm.nbytes + fm.nbytes)
+
+        if tcoords:
+            recipe['table'] = [[[cell.font_path for cell in row] for row in tlayout.cells], tlayout.tdata]
             tcoords = {'left_top': [int(c) for c in tcoords],
-                       'size': [table.size[1], table.size[0]],
-                       'text': tdata}
+                       'size': [tlayout.size[1], tlayout.size[0]],
+                       'text': tlayout.tdata}
+
+        page = {'image': bg.convert('RGB'),
+                'row_coords': {'rows': row_coords, 'table': tcoords},
+                'recipe': recipe}
+
+        if raster:
+            page.update({'field_mask': fm, 'char_mask': cm})
+
+            if self.mask_stride > 1:
+                page = self._strided_masks(page, centers)
+
+        if vector:
+            page['annotation'] = self._annotation(size, chars, fields)
+
+        return page
+
+    def _saved_masks(self, page: dict) -> dict:
+        page = dict(page)
+        saved_bytes = 0
+
+        for key in ('field_mask', 'char_mask', 'field_mask_full', 'char_mask_full'):
+            if key in page:
+                num_classes = 2 if key.startswith('field') else len(self.alphabet) + 1
+                page[key] = masks.encode(page[key], num_classes, self.mask_format)
+                saved_bytes += page[key].nbytes
+
+        metrics.gauge('saved_mask_bytes', saved_bytes)
+        return page
+
+    def _encode_page(self, page: dict) -> Dict[str, bytes]:
+        with metrics.timer('page.encode'):
+            return self.writer.encode(self._saved_masks(page))
+
+    def _render_encoded(self, name: int, encode: bool = True) -> Tuple[Dict[str, bytes], dict]:
+        '''the encoded page (the page with saved masks if not encode) and its metrics record (None if disabled)'''
+        metrics.reset()
+        start = time.perf_counter()
+        page = self.render_page(name, annotate=not self.recipes_only)
+        members = self._encode_page(page) if encode else self._saved_masks(page)
+        record = metrics.collect()
+
+        if record is not None:
+            record['time']['page'] = time.perf_counter() - start
+
+        return members, record
+
+    def _write(self, name: int, members: Dict[str, bytes], record: dict, encoded: bool = True) -> None:
+        # a writer encodes a not encoded page itself, AsyncWriter does it off the generation thread
+        start = time.perf_counter()
+
+        if encoded:
+            self.writer.write(name, members)
+        else:
+            self.writer.write_sample(name, members)
+
+        if record is not None:
+            record['time']['page.write'] = time.perf_counter() - start
+            self.metrics.merge(record)
+
+            if self.metrics_sink:
+                self.metrics_sink.write({'page': name, **record})
+
+    def _sample(self, page: dict) -> Tuple[np.ndarray, np.ndarray, np.ndarray, dict]:
+        page = self._saved_masks(page)
+        row_coords = page['row_coords']
+
+        if 'annotation' in page:
+            row_coords = dict(row_coords, annotation=page['annotation'])
+
+        return np.array(page['image']), page.get('char_mask'), page.get('field_mask'), row_coords
+
+    def iter_samples(self, num: int = None, start: int = 0,
+                     workers: int = None,
+                     prefetch: int = None) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray, dict]]:
+        """
+        Stream pages from memory without writing them
+        yields (image (H, W, 3) uint8, char mask, field mask, row coords), masks in the configured mask_format,
+        None with annotation: vector, the vector annotation is row_coords['annotation']
+        num:      num of pages, endless if None
+        start:    first page index, pages are seeded by (seed, index) as in generate
+        workers:  num of generation processes
+        prefetch: max num of pages rendered ahead, workers * 2 by default
+        """
+
+        names = iter(count(start) if num is None else range(start, start + num))
+        workers = workers or self.workers
+
+        if workers <= 1:
+            for name in names:
+                yield self._sample(self.render_page(name))
+
+            return
+
+        pool = ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(self.config, metrics.enabled()))
+
+        try:
+            pending = deque(pool.submit(_sample_worker, name) for name in islice(names, prefetch or workers * 2))
+
+            while pending:
+                sample = pending.popleft().result()
+
+                for name in islice(names, 1):
+                    pending.append(pool.submit(_sample_worker, name))
+
+                yield sample
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def generate(self, workers: int = None) -> None:
+        try:
+            self._generate(workers or self.workers)
+        finally:
+            self.writer.close()
+
+            if self.metrics_sink:
+                self.metrics_sink.write({'summary': self.metrics.summary()})
+                self.metrics_sink.close()
+
+    def _generate(self, workers: int) -> None:
+        first_name = self.writer.next_name()
+        self.writer.save_config(self.config)
+        # pages a crashed run left unwritten below first_name are generated first
+        names = [*self.writer.missing_names(), *range(first_name, first_name + self.num_imgs)]
+        total = len(names)
+
+        if workers <= 1:
+            # pages are encoded here as in the workers, AsyncWriter encodes them off the generation thread
+            encode = not isinstance(self.writer, AsyncWriter)
+
+            for name in tqdm(names):
+                self._write(name, *self._render_encoded(name, encode=encode), encoded=encode)
+
+            return
+
+        errors = []
+        written = 0
+        names = iter(names)
+
+        initargs = (self.config, metrics.enabled())
+
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=initargs) as pool, \
+                tqdm(total=total) as pbar:
+            pending = {pool.submit(_render_worker, name): name for name in islice(names, workers * 2)}
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    name = pending.pop(future)
+
+                    try:
+                        self._write(name, *future.result())
+                        written += 1
+                    except Exception as e:
+                        errors.append((name, e))
+
+                    pbar.update()
+
+                    if not isinstance(future.exception(), BrokenProcessPool):
+                        for next_name in islice(names, 1):
+                            pending[pool.submit(_render_worker, next_name)] = next_name
+
+        if errors:
+            raise RuntimeError(f'{total - written} of {total} pages were not generated, '
+                               f'first error on page {errors[0][0]}: {errors[0][1]!r}')
+
+
+_worker_generator = None
+
+
+def _init_worker(config: dict, metrics_enabled: bool = False) -> None:
+    global _worker_generator
+    _worker_generator = Generator(config)
+    metrics.enable(metrics_enabled)
+
+
+def _render_worker(name: int) -> Tuple[Dict[str, bytes], dict]:
+    return _worker_generator._render_encoded(name)
+
 
-            with open(os.path.join(self.save_subfolders[3], f'{name}.json'), 'w', encoding='utf-8') as jf:
-                json.dump({'rows': row_coords, 'table': tcoords}, jf, indent=4, ensure_ascii=False)
+def _sample_worker(name: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray, dict]:
+    return _worker_generator._sample(_worker_generator.render_page(name))
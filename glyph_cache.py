@@ -0,0 +1,71 @@
+import metrics
+import numpy as np
+
+from cache import LRUCache
+from collections import namedtuple
+from PIL import Image, ImageDraw, ImageFont
+
+
+'''
+GlyphCache(max_glyphs, max_fonts)
+bounded LRU caches of parsed fonts and rendered glyphs
+
+GlyphCache.glyph(font_path, font_size, stroke_width, char)
+returns Glyph:
+    mask    - 'L' image with the full glyph coverage, drawn at origin + offset
+    offset  - (x, y) of the mask relative to the draw origin
+    bbox    - (x, y, w, h) ink box inside the (0, 0, advance) window, as cv2.boundingRect returns it,
+              None if the glyph has no ink there
+    advance - font.getsize(char), the step to the next char and the label window
+'''
+
+
+Glyph = namedtuple('Glyph', ['mask', 'offset', 'bbox', 'advance'])
+
+
+class GlyphCache():
+    def __init__(self, max_glyphs: int = 65536, max_fonts: int = 128) -> None:
+        self.fonts = LRUCache(max_fonts)
+        self.glyphs = LRUCache(max_glyphs)
+
+    def font(self, font_path: str, font_size: int) -> ImageFont.FreeTypeFont:
+        key = (font_path, font_size)
+        font = self.fonts.get(key)
+
+        if font is None:
+            font = ImageFont.truetype(font_path, size=font_size)
+            self.fonts.put(key, font)
+
+        return font
+
+    def glyph(self, font_path: str, font_size: int, stroke_width: int, char: str) -> Glyph:
+        key = (font_path, font_size, stroke_width, char)
+        glyph = self.glyphs.get(key)
+
+        if glyph is None:
+            metrics.count('glyph_cache.misses')
+            glyph = self._render(self.font(font_path, font_size), stroke_width, char)
+            self.glyphs.put(key, glyph)
+        else:
+            metrics.count('glyph_cache.hits')
+
+        return glyph
+
+    def _render(self, font: ImageFont.FreeTypeFont, stroke_width: int, char: str) -> Glyph:
+        advance = font.getsize(char)
+        left, top, right, bottom = font.getbbox(char, stroke_width=stroke_width)
+        x0, y0 = min(left, 0), min(top, 0)
+        x1, y1 = max(right, advance[0]), max(bottom, advance[1])
+        mask = Image.new('L', (x1 - x0, y1 - y0), 0)
+        ImageDraw.Draw(mask).text((-x0, -y0), char, font=font, fill=255,
+                                  stroke_width=stroke_width, stroke_fill=255)
+
+        window = np.array(mask)[-y0:-y0 + advance[1], -x0:-x0 + advance[0]]
+        ys, xs = np.nonzero(window)
+        bbox = None
+
+        if len(xs):
+            x, y = int(xs.min()), int(ys.min())
+            bbox = (x, y, int(xs.max()) - x + 1, int(ys.max()) - y + 1)
+
+        return Glyph(mask, (x0, y0), bbox, advance)
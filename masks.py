@@ -0,0 +1,313 @@
+import cv2
+import math
+import numpy as np
+
+from PIL import Image
+from typing import List, Tuple
+
+
+'''
+compact char / field masks
+
+mask formats:
+    label   - (H, W) uint8/uint16 class-index map, 0 is background
+    bitmask - (ceil(C / 8), H, W) uint8, one-hot packed along the class axis (np.packbits order),
+              keeps overlapping classes
+    onehot  - (C, H, W) float64 legacy layout, carried as bitmask and expanded only on save
+
+while compositing, packed masks keep the background bit clear,
+encode() sets it where no class is present
+
+downsample() reduces a mask to a model output stride, (ceil(H / stride), ceil(W / stride)):
+    majority - the most frequent class of every stride x stride block (a packed class bit is kept
+               if it covers more than half of the block)
+    center   - the pixel at the block center
+
+rasterize() draws vector annotations, (N, 4, 2) quads of class codes in page pixel coords,
+into a mask of any resolution: a pixel gets the codes of the quads covering its center
+'''
+
+
+MASK_FORMATS = ('label', 'bitmask', 'onehot')
+STRIDE_MODES = ('majority', 'center')
+
+
+def label_dtype(num_classes: int) -> np.dtype:
+    return np.dtype(np.uint8) if num_classes <= 256 else np.dtype(np.uint16)
+
+
+def new_mask(num_classes: int, h: int, w: int, mask_format: str = 'label') -> np.ndarray:
+    if mask_format not in MASK_FORMATS:
+        raise ValueError(f'mask_format must be one of {MASK_FORMATS}, got {mask_format}')
+
+    if mask_format == 'label':
+        return np.zeros((h, w), dtype=label_dtype(num_classes))
+
+    return np.zeros(((num_classes + 7) // 8, h, w), dtype=np.uint8)
+
+
+def from_labels(labels: np.ndarray, num_classes: int, mask_format: str = 'label') -> np.ndarray:
+    '''a (h, w) label map as a compositing mask of mask_format'''
+    if mask_format == 'label':
+        return labels.astype(label_dtype(num_classes), copy=False)
+
+    mask = new_mask(num_classes, *labels.shape, mask_format)
+    ys, xs = np.nonzero(labels)
+    codes = labels[ys, xs].astype(np.int64)
+    mask[codes >> 3, ys, xs] = (0x80 >> (codes & 7)).astype(np.uint8)
+    return mask
+
+
+def is_packed(mask: np.ndarray) -> bool:
+    return mask.ndim == 3
+
+
+def fill_rect(mask: np.ndarray, code: int, x0: int, y0: int, x1: int, y1: int) -> np.ndarray:
+    '''fills [x0, x1] x [y0, y1] (inclusive, like cv2.rectangle) with class code'''
+    x0, y0 = max(x0, 0), max(y0, 0)
+
+    if is_packed(mask):
+        mask[code >> 3, y0:y1 + 1, x0:x1 + 1] |= 0x80 >> (code & 7)
+    else:
+        mask[y0:y1 + 1, x0:x1 + 1] = code
+
+    return mask
+
+
+def set_class(mask: np.ndarray, code: int, layer: np.ndarray, left_top: Tuple[int, int]) -> np.ndarray:
+    '''marks pixels of the bool layer placed at left_top (x, y) with class code, in place'''
+    region, layer = _clip(mask, layer, left_top)
+
+    if is_packed(mask):
+        region[code >> 3][layer] |= 0x80 >> (code & 7)
+    else:
+        region[layer] = code
+
+    return mask
+
+
+def paste(mask: np.ndarray, crop: np.ndarray, left_top: Tuple[int, int]) -> np.ndarray:
+    '''pastes crop (same format as mask) at left_top (x, y), in place; background never overwrites'''
+    region, crop = _clip(mask, crop, left_top)
+
+    if is_packed(mask):
+        region |= crop
+    else:
+        nonzero = crop != 0
+        region[nonzero] = crop[nonzero]
+
+    return mask
+
+
+def resize(mask: np.ndarray, size: Tuple[int, int]) -> np.ndarray:
+    '''nearest-neighbour resize to size (w, h)'''
+    if not is_packed(mask):
+        return cv2.resize(mask, size, interpolation=cv2.INTER_NEAREST)
+
+    planes = np.ascontiguousarray(mask.transpose(1, 2, 0))
+    planes = cv2.resize(planes, size, interpolation=cv2.INTER_NEAREST)
+    return planes.reshape(size[1], size[0], -1).transpose(2, 0, 1)
+
+
+def rotation(size: Tuple[int, int], angle: float) -> Tuple[List[float], Tuple[int, int]]:
+    '''Image.rotate(angle, expand=True) geometry for an image of size (w, h):
+    the reverse affine matrix (a, b, c, d, e, f), output -> input, and the output size (w, h)'''
+    w, h = size
+    angle = angle % 360.0
+
+    if angle == 0:
+        return [1.0, 0.0, 0.0, 0.0, 1.0, 0.0], (w, h)
+
+    angle = -math.radians(angle)
+    a, b = round(math.cos(angle), 15), round(math.sin(angle), 15)
+    d, e = round(-math.sin(angle), 15), round(math.cos(angle), 15)
+    c = a * -w / 2.0 + b * -h / 2.0 + w / 2.0
+    f = d * -w / 2.0 + e * -h / 2.0 + h / 2.0
+    xx = [a * x + b * y + c for x, y in ((0, 0), (w, 0), (w, h), (0, h))]
+    yy = [d * x + e * y + f for x, y in ((0, 0), (w, 0), (w, h), (0, h))]
+    nw = math.ceil(max(xx)) - math.floor(min(xx))
+    nh = math.ceil(max(yy)) - math.floor(min(yy))
+
+    if angle in (-math.pi / 2, -math.pi, -3 * math.pi / 2):
+        # PIL transposes for these angles
+        nw, nh = (h, w) if angle != -math.pi else (w, h)
+    x, y = -(nw - w) / 2.0, -(nh - h) / 2.0
+    return [a, b, a * x + b * y + c, d, e, d * x + e * y + f], (nw, nh)
+
+
+def rotated_size(size: Tuple[int, int], angle: float) -> Tuple[int, int]:
+    return rotation(size, angle)[1]
+
+
+def rotate(mask: np.ndarray, angle: float) -> np.ndarray:
+    '''nearest-neighbour rotation with the geometry of Image.rotate(angle, expand=True)
+    a label map is warped once, packed masks four byte planes per warp'''
+    if angle == 0:
+        return mask
+
+    if is_packed(mask):
+        groups = -(-mask.shape[0] // 4)
+        planes = np.zeros((groups * 4, *mask.shape[1:]), dtype=np.uint8)
+        planes[:mask.shape[0]] = mask
+        rotated = [_rotate(np.ascontiguousarray(planes[i:i + 4].transpose(1, 2, 0)), angle)
+                   for i in range(0, len(planes), 4)]
+        return np.concatenate(rotated, axis=2).transpose(2, 0, 1)[:mask.shape[0]]
+
+    if mask.dtype == np.uint8:
+        return _rotate(mask, angle)
+
+    return _rotate(mask.astype(np.int32), angle).astype(mask.dtype)
+
+
+def strided_size(size: Tuple[int, int], stride: int) -> Tuple[int, int]:
+    return -(-size[0] // stride), -(-size[1] // stride)
+
+
+def downsample(mask: np.ndarray, stride: int, mode: str = 'majority') -> np.ndarray:
+    if stride == 1:
+        return mask
+
+    if mode not in STRIDE_MODES:
+        raise ValueError(f'stride mode must be one of {STRIDE_MODES}, got {mode}')
+
+    h, w = mask.shape[-2:]
+    sh, sw = strided_size((h, w), stride)
+
+    if mode == 'center':
+        ys = np.minimum(np.arange(sh) * stride + stride // 2, h - 1)
+        xs = np.minimum(np.arange(sw) * stride + stride // 2, w - 1)
+        return mask[..., ys[:, None], xs[None, :]]
+
+    pad = [(0, 0)] * (mask.ndim - 2) + [(0, sh * stride - h), (0, sw * stride - w)]
+    mask = np.pad(mask, pad)
+
+    if is_packed(mask):
+        reduced = np.zeros((mask.shape[0], sh, sw), dtype=np.uint8)
+
+        for i, plane in enumerate(mask):
+            counts = np.unpackbits(plane[None], axis=0).reshape(8, sh, stride, sw, stride).sum(axis=(2, 4))
+            reduced[i] = np.packbits(counts * 2 > stride * stride, axis=0)[0]
+
+        return reduced
+
+    # the mode of every block: sort it and take the value of its longest run, the lowest one on ties
+    blocks = np.sort(mask.reshape(sh, stride, sw, stride).transpose(0, 2, 1, 3).reshape(sh, sw, -1), axis=-1)
+    index = np.arange(blocks.shape[-1])
+    starts = np.where(np.concatenate([np.ones((sh, sw, 1), dtype=bool),
+                                      blocks[..., 1:] != blocks[..., :-1]], axis=-1), index, 0)
+    runs = index - np.maximum.accumulate(starts, axis=-1)
+    return np.take_along_axis(blocks, runs.argmax(axis=-1)[..., None], axis=-1)[..., 0]
+
+
+def box_quads(boxes: np.ndarray) -> np.ndarray:
+    '''(N, 4) boxes (x0, y0, x1, y1) to (N, 4, 2) quads, clockwise from the left top'''
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    x0, y0, x1, y1 = boxes.T
+    return np.stack([np.stack([x0, y0], -1), np.stack([x1, y0], -1),
+                     np.stack([x1, y1], -1), np.stack([x0, y1], -1)], axis=1)
+
+
+def rasterize(codes: np.ndarray, quads: np.ndarray, size: Tuple[int, int], num_classes: int,
+              scale: float = 1.0, mask_format: str = 'label') -> np.ndarray:
+    '''a (h, w) mask of the quads scaled by scale, later quads win on overlaps of a label map'''
+    h, w = size
+    mask = new_mask(num_classes, h, w, mask_format)
+    codes = np.asarray(codes)
+    quads = np.asarray(quads, dtype=np.float64).reshape(-1, 4, 2) * scale
+
+    if not len(quads):
+        return mask
+
+    # candidate pixels: the centers inside the quad bounding box, all quads at once
+    x0 = np.clip(np.ceil(quads[..., 0].min(axis=1) - 0.5), 0, w).astype(np.int64)
+    x1 = np.clip(np.floor(quads[..., 0].max(axis=1) - 0.5) + 1, 0, w).astype(np.int64)
+    y0 = np.clip(np.ceil(quads[..., 1].min(axis=1) - 0.5), 0, h).astype(np.int64)
+    y1 = np.clip(np.floor(quads[..., 1].max(axis=1) - 0.5) + 1, 0, h).astype(np.int64)
+    nx, ny = np.maximum(x1 - x0, 0), np.maximum(y1 - y0, 0)
+    counts = nx * ny
+    quad = np.repeat(np.arange(len(quads)), counts)
+    local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    px = x0[quad] + local % nx[quad]
+    py = y0[quad] + local // nx[quad]
+
+    # a center is inside if it lies on the same side of all four edges
+    cx, cy = px + 0.5, py + 0.5
+    start = quads[quad]
+    end = np.roll(start, -1, axis=1)
+    side = ((end[..., 0] - start[..., 0]) * (cy[:, None] - start[..., 1]) -
+            (end[..., 1] - start[..., 1]) * (cx[:, None] - start[..., 0]))
+    inside = (side >= 0).all(axis=1) | (side <= 0).all(axis=1)
+    px, py, quad = px[inside], py[inside], quad[inside]
+
+    if is_packed(mask):
+        code = codes[quad]
+        np.bitwise_or.at(mask, (code >> 3, py, px), (0x80 >> (code & 7)).astype(np.uint8))
+    else:
+        mask[py, px] = codes[quad]
+
+    return mask
+
+
+def encode(mask: np.ndarray, num_classes: int, mask_format: str) -> np.ndarray:
+    '''converts a compositing mask to its on-disk form'''
+    if mask_format == 'label':
+        return mask
+
+    mask = _with_background(mask)
+
+    if mask_format == 'onehot':
+        return to_onehot(mask, num_classes)
+
+    return mask
+
+
+def to_onehot(mask: np.ndarray, num_classes: int, dtype: np.dtype = np.float64) -> np.ndarray:
+    '''expands a label map or an encoded bitmask to (C, H, W) one-hot'''
+    if is_packed(mask):
+        return np.unpackbits(mask, axis=0, count=num_classes).astype(dtype)
+
+    onehot = np.zeros((num_classes, *mask.shape), dtype=dtype)
+
+    for code in range(num_classes):
+        onehot[code] = mask == code
+
+    return onehot
+
+
+def to_labels(mask: np.ndarray) -> np.ndarray:
+    '''any on-disk form (label, bitmask, onehot) to a label map, lowest class wins on overlaps'''
+    if mask.ndim == 2:
+        return mask
+
+    if np.issubdtype(mask.dtype, np.floating):
+        return np.argmax(np.round(mask), axis=0)
+
+    return np.argmax(np.unpackbits(mask, axis=0), axis=0)
+
+
+def _rotate(array: np.ndarray, angle: float) -> np.ndarray:
+    image = Image.fromarray(array)
+    return np.array(image.rotate(angle, expand=True, resample=Image.NEAREST))
+
+
+def _with_background(mask: np.ndarray) -> np.ndarray:
+    mask = mask.copy()
+    chars = (mask[0] & 0x7f) != 0
+
+    if mask.shape[0] > 1:
+        chars |= np.bitwise_or.reduce(mask[1:], axis=0) != 0
+
+    mask[0][~chars] |= 0x80
+    return mask
+
+
+def _clip(mask: np.ndarray, crop: np.ndarray,
+          left_top: Tuple[int, int]) -> Tuple[np.ndarray, np.ndarray]:
+    x, y = int(left_top[0]), int(left_top[1])
+    h, w = mask.shape[-2:]
+    ch, cw = crop.shape[-2:]
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + cw, w), min(y + ch, h)
+    region = mask[..., y0:y1, x0:x1]
+    crop = crop[..., y0 - y:y1 - y, x0 - x:x1 - x]
+    return region, crop
@@ -0,0 +1,139 @@
+import os
+import json
+import time
+
+from contextlib import nullcontext
+from collections import defaultdict
+
+
+'''
+opt-in instrumentation, every call is a no-op until enable()
+
+metrics.timer(name)         context manager, adds the wall time of the block to time[name], s
+metrics.count(name, value)  adds value to count[name]
+metrics.gauge(name, value)  keeps the max value of gauge[name]
+metrics.collect()           returns {'time', 'count', 'gauge'} recorded since the last collect and resets them
+
+a record is collected per page in the process that renders it, the parent writes the records to a sink
+and merges them into a Metrics summary, so the summary aggregates all worker processes
+
+sinks have write(record) and close(), configured as {SinkName: {param: value}}
+'''
+
+
+class Metrics():
+    def __init__(self) -> None:
+        self.enabled = False
+        self.pages = 0
+        self.reset()
+
+    def reset(self) -> None:
+        self.times = defaultdict(float)
+        self.counts = defaultdict(int)
+        self.gauges = {}
+
+    def collect(self) -> dict:
+        record = {'time': dict(self.times), 'count': dict(self.counts), 'gauge': dict(self.gauges)}
+        self.reset()
+        return record
+
+    def merge(self, record: dict) -> None:
+        self.pages += 1
+
+        for name, value in record['time'].items():
+            self.times[name] += value
+
+        for name, value in record['count'].items():
+            self.counts[name] += value
+
+        for name, value in record['gauge'].items():
+            self.gauges[name] = max(self.gauges.get(name, value), value)
+
+    def summary(self) -> dict:
+        '''totals, per page means, gauge peaks and the hit rate of every "<name>.hits" / "<name>.misses" pair'''
+        pages = max(self.pages, 1)
+        hit_rate = {}
+
+        for name, hits in self.counts.items():
+            if name.endswith('.hits'):
+                name = name[:-len('.hits')]
+                total = hits + self.counts.get(name + '.misses', 0)
+                hit_rate[name] = hits / total if total else None
+
+        return {'pages': self.pages,
+                'time': dict(self.times),
+                'time_per_page': {name: value / pages for name, value in self.times.items()},
+                'count': dict(self.counts),
+                'count_per_page': {name: value / pages for name, value in self.counts.items()},
+                'gauge': dict(self.gauges),
+                'hit_rate': hit_rate}
+
+
+class _Timer():
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def __enter__(self) -> None:
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc) -> None:
+        _metrics.times[self.name] += time.perf_counter() - self.start
+
+
+class JsonLinesSink():
+    '''appends a json line per record to path, the file is opened on the first record'''
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.file = None
+
+    def write(self, record: dict) -> None:
+        if self.file is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self.file = open(self.path, 'a', encoding='utf-8')
+
+        self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self.file.flush()
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+_metrics = Metrics()
+_null_timer = nullcontext()
+
+
+def enable(enabled: bool = True) -> None:
+    _metrics.enabled = enabled
+    _metrics.reset()
+
+
+def enabled() -> bool:
+    return _metrics.enabled
+
+
+def timer(name: str):
+    return _Timer(name) if _metrics.enabled else _null_timer
+
+
+def count(name: str, value: int = 1) -> None:
+    if _metrics.enabled:
+        _metrics.counts[name] += value
+
+
+def gauge(name: str, value: float) -> None:
+    if _metrics.enabled:
+        _metrics.gauges[name] = max(_metrics.gauges.get(name, value), value)
+
+
+def reset() -> None:
+    _metrics.reset()
+
+
+def collect() -> dict:
+    '''the record since the last collect, None if disabled'''
+    return _metrics.collect() if _metrics.enabled else None
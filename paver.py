@@ -1,4 +1,5 @@
 import random
+import metrics
 import numpy as np
 
 from copy import copy
@@ -9,14 +10,143 @@ from typing import Tuple, Union
 Paver(H, W)
 solves the problem of non-optimal tiling of a H x W field with random rectangles along random coordinates
 
-Paver.get_random_coords(H, W)
-returns the coords of the H x W rect placement on the field if it possible
+Paver.get_random_coords(W, H)
+returns the coords of the W x H rect placement on the field if it possible
 fills the field with input rectangles
 if there is no space left on the field returns None
+
+Paver.fits(W, H), Paver.max_scale(W, H), Paver.max_width(H), Paver.largest_free_rect()
+free space queries, so a rect can be sized to the space left before it is rendered
+Paver.density() - the share of the field the placed rects cover
+
+Paver keeps the free space as a list of maximal free rectangles, so a placement costs
+O(free rects) instead of O(H * W); the coords are uniform over all valid placements,
+placed rects keep a delta margin to each other
+RasterPaver is the original per-pixel implementation with the same behaviour
 '''
 
 
 class Paver():
+    def __init__(self, h: int, w: int, i: int, delta: int = 10, rng: random.Random = None) -> None:
+        self.i = i
+        self.rng = rng or random
+        self.h = h
+        self.w = w
+        self.delta = delta
+        # maximal free rects (x0, y0, x1, y1), x1 and y1 exclusive
+        # a rect fits if its left top lies in [x0, x1 - w] x [y0, y1 - h]
+        self.free = np.array([[0, 0, w - 1, h - 1]], dtype=np.int64)
+        self.placed = []
+
+    def _ranges(self, w: int, h: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        free = self.free
+        xs = free[:, 2] - free[:, 0] - w + 1
+        ys = free[:, 3] - free[:, 1] - h + 1
+        fits = (xs > 0) & (ys > 0)
+        return free[fits], xs[fits], ys[fits]
+
+    def fits(self, w: int, h: int) -> bool:
+        '''a w x h rect can be placed'''
+        free = self.free
+        return bool(((free[:, 2] - free[:, 0] >= w) & (free[:, 3] - free[:, 1] >= h)).any())
+
+    def largest_free_rect(self) -> Union[Tuple[int, int, int, int], None]:
+        '''(x, y, w, h) of the free rect of the largest area, a rect up to w x h fits at (x, y)'''
+        if len(self.free) == 0:
+            return None
+
+        x0, y0, x1, y1 = self.free[int(np.argmax((self.free[:, 2] - self.free[:, 0]) *
+                                                 (self.free[:, 3] - self.free[:, 1])))].tolist()
+        return x0, y0, x1 - x0, y1 - y0
+
+    def max_scale(self, w: int, h: int) -> float:
+        '''the largest factor a w x h rect can be scaled by to fit, 0 if no free space is left'''
+        free = self.free
+        scales = np.minimum((free[:, 2] - free[:, 0]) / w, (free[:, 3] - free[:, 1]) / h)
+        return float(scales.max()) if len(scales) else 0.0
+
+    def max_width(self, h: int) -> int:
+        '''the widest rect of height h that fits, 0 if none'''
+        free = self.free
+        widths = (free[:, 2] - free[:, 0])[free[:, 3] - free[:, 1] >= h]
+        return int(widths.max()) if len(widths) else 0
+
+    def density(self) -> float:
+        '''the share of the field covered by the placed rects'''
+        return sum(w * h for _, _, w, h in self.placed) / (self.h * self.w)
+
+    def get_random_coords(self, w: int, h: int) -> Union[Tuple[int, int], None]:
+        metrics.count('paver.attempts')
+
+        if w <= 0 or h <= 0:
+            metrics.count('paver.rejects')
+            return None
+
+        free, xs, ys = self._ranges(w, h)
+
+        if len(free) == 0:
+            metrics.count('paver.rejects')
+            return None
+
+        # uniform over the union of the left top ranges: pick a point uniformly over all ranges
+        # and accept it with 1 / (num of ranges covering it)
+        bounds = np.cumsum(xs * ys)
+        samples = 0
+
+        while True:
+            samples += 1
+            n = self.rng.randrange(int(bounds[-1]))
+            k = int(np.searchsorted(bounds, n, side='right'))
+            dy, dx = divmod(n - (int(bounds[k - 1]) if k else 0), int(xs[k]))
+            x = int(free[k, 0]) + dx
+            y = int(free[k, 1]) + dy
+            covers = int(((free[:, 0] <= x) & (x < free[:, 0] + xs) & (free[:, 1] <= y) & (y < free[:, 1] + ys)).sum())
+
+            if covers == 1 or self.rng.random() * covers < 1:
+                break
+
+        metrics.count('paver.samples', samples)
+        metrics.gauge('paver.free_rects', len(self.free))
+        self._occupy(x - self.delta - 1, y - self.delta - 1, x + w + self.delta, y + h + self.delta)
+        self.placed.append((x, y, w, h))
+        return x, y
+
+    def _occupy(self, x0: int, y0: int, x1: int, y1: int) -> None:
+        free = self.free
+        hit = (free[:, 0] < x1) & (x0 < free[:, 2]) & (free[:, 1] < y1) & (y0 < free[:, 3])
+
+        if not hit.any():
+            return
+
+        keep = free[~hit]
+        split = free[hit]
+        left = split[split[:, 0] < x0].copy()
+        left[:, 2] = x0
+        right = split[split[:, 2] > x1].copy()
+        right[:, 0] = x1
+        top = split[split[:, 1] < y0].copy()
+        top[:, 3] = y0
+        bottom = split[split[:, 3] > y1].copy()
+        bottom[:, 1] = y1
+        pieces = np.concatenate([left, right, top, bottom])
+
+        # drop pieces contained in a kept rect or in another piece (keeping one of equal pieces)
+        inside_keep = self._contained(pieces, keep).any(axis=1)
+        inside = self._contained(pieces, pieces)
+        equal = inside & inside.T
+        inside &= ~equal | np.tri(len(pieces), k=-1, dtype=bool)
+        pieces = pieces[~inside_keep & ~inside.any(axis=1)]
+        self.free = np.concatenate([keep, pieces])
+
+    def _contained(self, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        '''(len(a), len(b)) bool, a[i] lies inside b[j]'''
+        a = a[:, None]
+        b = b[None]
+        return ((a[..., 0] >= b[..., 0]) & (a[..., 1] >= b[..., 1]) &
+                (a[..., 2] <= b[..., 2]) & (a[..., 3] <= b[..., 3]))
+
+
+class RasterPaver():
     def __init__(self, h: int, w: int, i: int) -> None:
         self.i = i
         self.field = np.zeros((h, w))
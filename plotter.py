@@ -1,32 +1,60 @@
 import os
 import cv2
-import json
+import math
+import masks
+import random
+import argparse
 import numpy as np
 
 from tqdm import tqdm
-from typing import Tuple
+from typing import List, Tuple, Union
+from concurrent.futures import ProcessPoolExecutor
+from dataset_reader import DatasetReader
 
 
 '''
 Plotter(data_path)
 plots and saves debug images with charmasks and words/rows coords
 
-data_path folder should have 3 subfolders: "images", "row_coords", "char_masks"
-also creates "plots" subfolder for save debug images
+data_path is a folder DatasetReader reads (FileWriter folders, ShardWriter shards or RecipeWriter recipes),
+vector annotated pages are rasterized, also creates "plots" subfolder for save debug images
+
+chars are blended with a per-class int2rgb palette lookup, pages are plotted in worker processes
+with workers > 1, sample=N plots N random pages, contact_sheet writes one thumbnail grid instead
 '''
 
 
 class Plotter():
     def __init__(self, data_path: str) -> None:
-        self.imgs_path = os.path.join(data_path, 'images')
-        self.fb_path = os.path.join(data_path, 'row_coords')
-        self.cm_path = os.path.join(data_path, 'char_masks')
         self.plot_path = os.path.join(data_path, 'plots')
-        self.names = [name.replace('.png', '') for name in os.listdir(self.imgs_path) if name.endswith('png')]
+        self.data_path = data_path
+        self.reader = DatasetReader(data_path)
+        self.names = [str(name) for name in self.reader.names]
+        self._palette = np.zeros((0, 3), dtype=np.int64)
+        self._alpha = 80 / 255.0
 
         if not os.path.exists(self.plot_path):
             os.mkdir(self.plot_path)
 
+    def _read_image(self, name: str) -> np.ndarray:
+        '''BGR page image'''
+        return cv2.cvtColor(self.reader.read(int(name), 'image'), cv2.COLOR_RGB2BGR)
+
+    def _read_char_mask(self, name: str) -> np.ndarray:
+        if 'char_mask' not in self.reader.fields(int(name)):
+            return self._rasterize(self.reader.read(int(name), 'annotation'))
+
+        return self.reader.read(int(name), 'char_mask')
+
+    def _rasterize(self, annotation: dict) -> np.ndarray:
+        '''the char label map of a vector annotated page'''
+        codes = annotation['char_codes']
+        num_classes = int(codes.max()) + 1 if len(codes) else 1
+        return masks.rasterize(codes, annotation['char_quads'], annotation['size'], num_classes)
+
+    def _read_row_coords(self, name: str) -> dict:
+        return self.reader.read(int(name), 'row_coords')
+
     def int2rgb(self, RGBint: int) -> Tuple[int, int, int]:
         RGBint *= 123432
         blue = RGBint & 255
@@ -34,62 +62,115 @@ class Plotter():
         red = (RGBint >> 16) & 255
         return int(red), int(green), int(blue)
 
-    def plot(self, filename: str = None,
-             plot_rows: bool = True, plot_chars: bool = True) -> None:
+    def palette(self, num_classes: int) -> np.ndarray:
+        '''(num_classes, 3) int2rgb lookup table'''
+        if len(self._palette) < num_classes:
+            codes = np.arange(num_classes, dtype=np.int64) * 123432
+            self._palette = np.stack([(codes >> 16) & 255, (codes >> 8) & 255, codes & 255], axis=1)
+
+        return self._palette[:num_classes]
+
+    def render(self, name: str, plot_rows: bool = True, plot_chars: bool = True) -> np.ndarray:
+        img = self._read_image(name)
+
+        if plot_chars:
+            cm = masks.to_labels(self._read_char_mask(name))
+
+            if cm.shape != img.shape[:2]:
+                # a mask saved at the model output stride
+                stride = -(-img.shape[0] // cm.shape[0])
+                cm = np.repeat(np.repeat(cm, stride, axis=0), stride, axis=1)[:img.shape[0], :img.shape[1]]
+
+            chars = cm != 0
+            overlay = self.palette(int(cm.max()) + 1)[cm[chars]]
+            img[chars] = self._alpha * overlay + (1.0 - self._alpha) * img[chars]
+
+        if plot_rows:
+            fb = self._read_row_coords(name)
+
+            for item in fb['rows']:
+                right_bot = (item['left_top'][0] + item['size'][1],
+                             item['left_top'][1] + item['size'][0])
+                cv2.rectangle(img, item['left_top'], right_bot, color=(0, 255, 0), thickness=1)
+
+            if fb['table']:
+                tright_bot = (fb['table']['left_top'][0] + fb['table']['size'][1],
+                              fb['table']['left_top'][1] + fb['table']['size'][0])
+                cv2.rectangle(img, fb['table']['left_top'], tright_bot, color=(0, 0, 255), thickness=2)
+
+        return img
+
+    def plot(self, filename: str = None, plot_rows: bool = True, plot_chars: bool = True,
+             workers: int = 1, sample: int = None, seed: int = 0,
+             contact_sheet: str = None, thumb_width: int = 320) -> None:
+        '''plots all pages, filename only, or a random sample of pages;
+        with contact_sheet set, writes a single grid of page thumbnails to plots/<contact_sheet> instead'''
         if filename:
             names = [filename]
         else:
-            names = self.names
+            names = sorted(self.names, key=lambda name: (len(name), name))
+
+        if sample is not None and sample < len(names):
+            names = sorted(random.Random(seed).sample(names, sample), key=lambda name: (len(name), name))
+
+        thumb = thumb_width if contact_sheet else None
+        args = [(name, plot_rows, plot_chars, thumb) for name in names]
+
+        if workers > 1 and len(names) > 1:
+            with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(self.data_path,)) as pool:
+                thumbs = list(tqdm(pool.map(_plot_worker, args, chunksize=4), total=len(args)))
+        else:
+            thumbs = [self._plot(*item) for item in tqdm(args)]
 
-        for name in tqdm(names):
-            img = cv2.imread(os.path.join(self.imgs_path, name + '.png'))
+        if contact_sheet:
+            cv2.imwrite(os.path.join(self.plot_path, contact_sheet), self._contact_sheet(thumbs))
 
-            if plot_chars:
-                cm = np.load(os.path.join(self.cm_path, name + '.npy'))
+    def _plot(self, name: str, plot_rows: bool, plot_chars: bool,
+              thumb_width: int = None) -> Union[np.ndarray, None]:
+        img = self.render(name, plot_rows, plot_chars)
 
-                cm = np.round(cm)
-                cm = np.argmax(cm, axis=0)
-                cm2 = np.ones(img.shape)
-                alpha = np.zeros(img.shape[:-1])
+        if thumb_width is None:
+            cv2.imwrite(os.path.join(self.plot_path, name + '.png'), img)
+            return None
 
-                for y in range(cm.shape[0]):
-                    for x in range(cm.shape[1]):
-                        r, g, b = self.int2rgb(cm[y][x])
-                        cm2[y][x] = np.array([r, g, b])
+        thumb_height = max(round(img.shape[0] * thumb_width / img.shape[1]), 1)
+        return cv2.resize(img, (thumb_width, thumb_height), interpolation=cv2.INTER_AREA)
 
-                        if cm[y][x] != 0:
-                            alpha[y][x] = 80
+    def _contact_sheet(self, thumbs: List[np.ndarray]) -> np.ndarray:
+        cols = math.ceil(math.sqrt(len(thumbs)))
+        rows = math.ceil(len(thumbs) / cols)
+        cell_h = max(thumb.shape[0] for thumb in thumbs)
+        cell_w = max(thumb.shape[1] for thumb in thumbs)
+        sheet = np.full((rows * cell_h, cols * cell_w, 3), 255, dtype=np.uint8)
 
-                cm2 = cm2.astype(int)
-                cm2 = np.transpose(cm2, (2, 0, 1))
-                cm2 = np.array([*cm2, alpha])
-                cm2 = np.transpose(cm2, (1, 2, 0))
+        for i, thumb in enumerate(thumbs):
+            y, x = i // cols * cell_h, i % cols * cell_w
+            sheet[y:y + thumb.shape[0], x:x + thumb.shape[1]] = thumb
 
-                y1, y2 = 0, 0 + cm2.shape[0]
-                x1, x2 = 0, 0 + cm2.shape[1]
+        return sheet
 
-                alpha_s = cm2[:, :, 3] / 255.0
-                alpha_l = 1.0 - alpha_s
 
-                for c in range(0, 3):
-                    img[y1:y2, x1:x2, c] = (alpha_s * cm2[:, :, c] + alpha_l * img[y1:y2, x1:x2, c])
+_worker_plotter = None
 
-            if plot_rows:
-                with open(os.path.join(self.fb_path, name + '.json'), 'r', encoding='utf-8') as jf:
-                    fb = json.load(jf)
 
-                for item in fb['rows']:
-                    right_bot = (item['left_top'][0] + item['size'][1],
-                                 item['left_top'][1] + item['size'][0])
-                    cv2.rectangle(img, item['left_top'], right_bot, color=(0, 255, 0), thickness=1)
+def _init_worker(data_path: str) -> None:
+    global _worker_plotter
+    _worker_plotter = Plotter(data_path)
 
-                tright_bot = (fb['table']['left_top'][0] + fb['table']['size'][1],
-                              fb['table']['left_top'][1] + fb['table']['size'][0])
-                cv2.rectangle(img, fb['table']['left_top'], tright_bot, color=(0, 0, 255), thickness=2)
 
-            cv2.imwrite(os.path.join(self.plot_path, name + '.png'), img)
+def _plot_worker(args: tuple) -> Union[np.ndarray, None]:
+    return _worker_plotter._plot(*args)
 
 
 if __name__ == "__main__":
-    plotter = Plotter('gen_data')
-    plotter.plot(plot_rows=True, plot_chars=True)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('data_path', type=str, nargs='?', default='gen_data', help='Generated data folder')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Plotting processes')
+    parser.add_argument('-s', '--sample', type=int, default=None, help='Plot N random pages')
+    parser.add_argument('--contact-sheet', type=str, default=None,
+                        help='Write one thumbnail grid with this file name instead of per page plots')
+    args = parser.parse_args()
+
+    plotter = Plotter(args.data_path)
+    plotter.plot(plot_rows=True, plot_chars=True, workers=args.workers,
+                 sample=args.sample, contact_sheet=args.contact_sheet)
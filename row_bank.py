@@ -0,0 +1,252 @@
+import os
+import json
+import random
+import masks
+import metrics
+import numpy as np
+
+from PIL import Image
+from cache import LRUCache
+from collections import namedtuple
+from typing import Iterator, List, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from row_generator import RowGenerator
+
+
+'''
+RowBank(path, slots, slot_size, max_text_len, refresh_pages, workers, cache_size_mb,
+        row_config, alphabet, seed, mask_format, rng)
+a memory-mapped bank of pre-rendered rows, pages are composed by pasting bank rows instead of rendering them
+
+path.rgba.npy    (slots, h, w, 4) uint8 row crops, a row fills the left top (size) of its slot
+path.labels.npy  (slots, h, w) char label crops
+path.sizes.npy   (slots, 2) int32 row crop (w, h)
+path.boxes.npy   (slots, max_text_len, 5) int32 char boxes (code, x0, y0, x1, y1) in crop coords, code 0 pads
+path.texts.npy   (slots,) row texts
+path.fonts.npy   (slots,) int32 font of a row, an index of the RowGenerator fonts
+path.font_sizes.npy (slots,) float32 font size of a row
+path.json        the bank parameters and row config, the bank is rebuilt if they change
+
+the bank is filled once on a process pool of workers (all cpus by default) and memory-mapped read-only
+by every generation process; slot s at page n holds the row seeded by (seed, s, version),
+version = (n + s * refresh_pages // slots) // refresh_pages, so every slot is rendered again every refresh_pages
+pages (staggered over the slots, never if refresh_pages is empty) and a page depends only on (seed, page index)
+the files hold version 0, a later version is rendered when a page samples it and kept in an LRU cache
+of cache_size_mb per process, keyed by (slot, version)
+
+RowBank.resized(row, scale) scales a row down, not below the min RowGenerator font size, to fit the space left on a page
+'''
+
+
+BankRow = namedtuple('BankRow', ['text', 'font_path', 'slot', 'version', 'size'])
+
+
+class RowBank():
+    def __init__(self, path: str, slots: int, slot_size: List[int], max_text_len: int = 64,
+                 refresh_pages: int = None, workers: int = None, cache_size_mb: int = 64, row_config: dict = None,
+                 alphabet: str = '', seed: int = 0, mask_format: str = 'label', rng: random.Random = None) -> None:
+        self.path = path
+        self.slots = slots
+        self.slot_h, self.slot_w = slot_size
+        self.max_text_len = max_text_len
+        self.refresh_pages = refresh_pages
+        self.row_config = row_config
+        self.alphabet = alphabet
+        self.seed = seed
+        self.mask_format = mask_format
+        # the page stream picks the slots, bank rows draw from their own stream
+        self.rng = rng or random
+        self.renderer = _SlotRenderer(row_config, alphabet, seed, slot_size, max_text_len)
+        self.fonts = self.renderer.fonts
+        self.min_font_size = min(self.renderer.rows.font_size)
+        meta = {'slots': slots, 'slot_size': [self.slot_h, self.slot_w], 'max_text_len': max_text_len,
+                'seed': seed, 'alphabet': alphabet, 'rows': row_config, 'fonts': self.fonts}
+
+        if self._load_meta() != meta:
+            self._build(meta, workers)
+
+        self.arrays = self._open('r')
+        # refreshed rows, cropped to their size
+        self.refreshed = LRUCache(cache_size_mb * 2 ** 20,
+                                  lambda row: row['rgba'].nbytes + row['labels'].nbytes + row['boxes'].nbytes)
+
+    def layout(self, index: int) -> BankRow:
+        '''a random bank row as of page index'''
+        slot = self.rng.randrange(self.slots)
+        version = self._version(slot, index)
+
+        if version:
+            metrics.count('row_bank.hits' if (slot, version) in self.refreshed.items else 'row_bank.misses')
+
+        row = self._row(slot, version)
+        return BankRow(row['text'], self.fonts[row['font']], slot, version, row['size'])
+
+    def resized(self, row: BankRow, scale: float) -> BankRow:
+        '''the row scaled down by scale, not below the min font size'''
+        data = self._row(row.slot, row.version)
+        w, h = data['size']
+        min_h = max(int(h * self.min_font_size / data['font_size']), 1)
+        y = max(int(row.size[1] * min(scale, 1)), min(min_h, row.size[1]))
+        return row._replace(size=(max(int(y * w / h), 1), y))
+
+    def render(self, row: BankRow, with_mask: bool = True) -> Tuple[Image.Image, np.ndarray]:
+        '''the row crop and its char mask in mask_format, None instead of the mask if not with_mask'''
+        data = self._row(row.slot, row.version)
+        crop = Image.fromarray(np.array(data['rgba']), mode='RGBA')
+        resized = row.size != data['size']
+
+        if resized:
+            crop = crop.resize(row.size)
+
+        if not with_mask:
+            return crop, None
+
+        labels = masks.resize(np.array(data['labels']), row.size) if resized else np.array(data['labels'])
+        return crop, masks.from_labels(labels, len(self.alphabet) + 1, self.mask_format)
+
+    def char_boxes(self, row: BankRow) -> Iterator[Tuple[int, int, int, int, int]]:
+        '''(char code, x0, y0, x1, y1) of the labelled char boxes in the row crop, x1 and y1 exclusive'''
+        data = self._row(row.slot, row.version)
+        (w, h), (rw, rh) = data['size'], row.size
+
+        for char_code, x0, y0, x1, y1 in data['boxes'].tolist():
+            if char_code:
+                # the nearest-neighbour resize labels the crop pixels i with x0 <= floor(i * w / rw) < x1
+                yield char_code, -(-x0 * rw // w), -(-y0 * rh // h), -(-x1 * rw // w), -(-y1 * rh // h)
+
+    def char_centers(self, row: BankRow) -> Iterator[Tuple[int, float, float]]:
+        for char_code, x0, y0, x1, y1 in self.char_boxes(row):
+            yield char_code, (x0 + x1) / 2, (y0 + y1) / 2
+
+    def _row(self, slot: int, version: int) -> dict:
+        '''the row of (slot, version): from the bank files for version 0, else rendered once per process'''
+        if not version:
+            w, h = self.arrays['sizes'][slot].tolist()
+            return {'rgba': self.arrays['rgba'][slot, :h, :w], 'labels': self.arrays['labels'][slot, :h, :w],
+                    'size': (w, h), 'boxes': self.arrays['boxes'][slot], 'text': str(self.arrays['texts'][slot]),
+                    'font': int(self.arrays['fonts'][slot]), 'font_size': float(self.arrays['font_sizes'][slot])}
+
+        row = self.refreshed.get((slot, version))
+
+        if row is None:
+            row = self.renderer.render(slot, version)
+            self.refreshed.put((slot, version), row)
+
+        return row
+
+    def _version(self, slot: int, index: int) -> int:
+        if not self.refresh_pages:
+            return 0
+
+        return (index + slot * self.refresh_pages // self.slots) // self.refresh_pages
+
+    def _load_meta(self) -> dict:
+        if not all(os.path.exists(path) for path in self._paths().values()) or not os.path.exists(self.path + '.json'):
+            return None
+
+        with open(self.path + '.json', 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _paths(self, suffix: str = '') -> dict:
+        return _paths(self.path, suffix)
+
+    def _open(self, mode: str, suffix: str = '') -> dict:
+        return {name: np.load(path, mmap_mode=mode) for name, path in self._paths(suffix).items()}
+
+    def _build(self, meta: dict, workers: int = None) -> None:
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        shapes = {'rgba': ((self.slots, self.slot_h, self.slot_w, 4), np.uint8),
+                  'labels': ((self.slots, self.slot_h, self.slot_w), masks.label_dtype(len(self.alphabet) + 1)),
+                  'sizes': ((self.slots, 2), np.int32),
+                  'boxes': ((self.slots, self.max_text_len, 5), np.int32),
+                  'texts': ((self.slots,), f'<U{self.max_text_len}'),
+                  'fonts': ((self.slots,), np.int32),
+                  'font_sizes': ((self.slots,), np.float32)}
+
+        for name, path in self._paths('.tmp').items():
+            shape, dtype = shapes[name]
+            # the arrays are allocated here and filled through their own maps
+            np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape).flush()
+
+        workers = min(workers or os.cpu_count() or 1, self.slots)
+        chunks = [range(i, self.slots, workers) for i in range(workers)]
+        params = (self.row_config, self.alphabet, self.seed, [self.slot_h, self.slot_w], self.max_text_len)
+
+        if workers > 1:
+            with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=params) as pool:
+                list(pool.map(_fill_worker, [self.path] * workers, chunks))
+        else:
+            self.renderer.fill(self.path, chunks[0])
+
+        for name, path in self._paths('.tmp').items():
+            os.replace(path, self._paths()[name])
+
+        with open(self.path + '.json', 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+
+
+class _SlotRenderer():
+    '''renders the rows of the bank slots with its own RowGenerator and random stream'''
+    _attempts = 20
+
+    def __init__(self, row_config: dict, alphabet: str, seed: int, slot_size: List[int], max_text_len: int) -> None:
+        self.rows = RowGenerator(**row_config, alphabet=alphabet, mask_format='label', rng=random.Random())
+        self.fonts = list(self.rows.fonts_names.values())
+        self.seed = seed
+        self.slot_h, self.slot_w = slot_size
+        self.max_text_len = max_text_len
+
+    def render(self, slot: int, version: int) -> dict:
+        '''the row of (slot, version): rgba, labels, size (w, h), boxes, text and font (an index of fonts)'''
+        self.rows.rng.seed(f'{self.seed}:bank:{slot}:{version}')
+
+        for _ in range(self._attempts):
+            layout = self.rows.layout()
+            w, h = layout.size
+
+            if w <= self.slot_w and h <= self.slot_h and len(layout.text) <= self.max_text_len:
+                break
+        else:
+            raise ValueError(f'rows do not fit the {self.slot_h}x{self.slot_w} RowBank slots, increase slot_size')
+
+        crop, labels = self.rows.render(layout)
+        boxes = np.zeros((self.max_text_len, 5), dtype=np.int32)
+        char_boxes = list(self.rows.char_boxes(layout))
+        boxes[:len(char_boxes)] = np.array(char_boxes, dtype=np.int32).reshape(-1, 5)
+        font_size = np.float32(h * RowGenerator._font_base_size / (layout.box[3] - layout.box[1]))
+        return {'rgba': np.array(crop), 'labels': labels, 'size': (w, h), 'boxes': boxes,
+                'text': layout.text, 'font': self.fonts.index(layout.font_path), 'font_size': float(font_size)}
+
+    def fill(self, path: str, slots: range) -> None:
+        arrays = {name: np.load(array_path, mmap_mode='r+') for name, array_path in _paths(path, '.tmp').items()}
+
+        for slot in slots:
+            row = self.render(slot, 0)
+            w, h = row['size']
+            arrays['rgba'][slot, :h, :w] = row['rgba']
+            arrays['labels'][slot, :h, :w] = row['labels']
+            arrays['sizes'][slot] = row['size']
+            arrays['texts'][slot] = row['text']
+            arrays['fonts'][slot] = row['font']
+            arrays['boxes'][slot] = row['boxes']
+            arrays['font_sizes'][slot] = row['font_size']
+
+        for array in arrays.values():
+            array.flush()
+
+
+def _paths(path: str, suffix: str = '') -> dict:
+    return {name: f'{path}.{name}{suffix}.npy'
+            for name in ('rgba', 'labels', 'sizes', 'boxes', 'texts', 'fonts', 'font_sizes')}
+
+
+_worker_renderer = None
+
+
+def _init_worker(*params) -> None:
+    global _worker_renderer
+    _worker_renderer = _SlotRenderer(*params)
+
+
+def _fill_worker(path: str, slots: range) -> None:
+    _worker_renderer.fill(path, slots)
@@ -1,27 +1,69 @@
 import os
-import cv2
 import random
 import numpy as np
+import masks
+import metrics
 
 from text_generators import *
-from typing import Union, Tuple
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image
+from font_index import FontIndex
+from glyph_cache import GlyphCache
+from collections import namedtuple
+from typing import Iterator, Union, Tuple
+
+
+'''
+RowGenerator.layout()
+picks text, font, color and size of a row and lays its glyphs out without drawing,
+RowLayout.size is the final crop size (w, h)
+
+RowGenerator.render(layout)
+draws the row crop and its chargrid mask
+
+RowGenerator.resized(layout, scale), RowGenerator.shortened(layout, width)
+a smaller layout of the same row, for a row to fit the space left on a page before it is drawn
+'''
+
+
+RowLayout = namedtuple('RowLayout', ['text', 'font_path', 'stroke_width', 'font_color', 'glyphs', 'box', 'size'])
 
 
 class RowGenerator():
+    _font_base_size = 50
+    _text_attempts = 10
+
     def __init__(self, alphabet: str, fonts_path: str, font_size: Union[int, list],
-                 text_generator: dict, font_color_range: list = [[0, 255], [0, 255], [0, 255]]) -> None:
+                 text_generator: dict, font_color_range: list = [[0, 255], [0, 255], [0, 255]],
+                 mask_format: str = 'onehot', glyph_cache_size: int = 65536, font_cache_size: int = 128,
+                 font_index_path: str = None, font_scan_workers: int = None, rng: random.Random = None) -> None:
         self.alphabet = alphabet
-        self.text_gen = globals()[list(text_generator.keys())[0]](**list(text_generator.values())[0], alphabet=alphabet)
+        self.mask_format = mask_format
+        self.rng = rng or random
+        self.glyph_cache = GlyphCache(glyph_cache_size, font_cache_size)
+        self.text_gen = globals()[list(text_generator.keys())[0]](**list(text_generator.values())[0], alphabet=alphabet,
+                                                                   rng=self.rng)
 
         _font_exs = ('ttf', 'TTF')
         if os.path.isdir(fonts_path):
-            self.fonts_names = {f: os.path.join(fonts_path, f) for f in os.listdir(fonts_path) if f.endswith(_font_exs)}
+            # sorted, the row draws index the fonts, os.listdir order differs between file systems
+            self.fonts_names = {f: os.path.join(fonts_path, f) for f in sorted(os.listdir(fonts_path))
+                                if f.endswith(_font_exs)}
         elif fonts_path.endswith(_font_exs):
             self.fonts_names = {fonts_path[fonts_path.rfind('/') + 1:]: fonts_path}
         elif not self.fonts_names:
             raise FileExistsError('font_path must be either a directory containing .ttf fonts or a path to a .ttf font')
 
+        # fonts that can not draw any alphabet char are dropped, rows pick a font that draws all their chars
+        self.font_index = FontIndex(list(self.fonts_names.values()), alphabet,
+                                    font_index_path or fonts_path.rstrip('/\\') + '.index.json', font_scan_workers)
+        usable = set(self.font_index.usable())
+        self.fonts_names = {name: path for name, path in self.fonts_names.items() if path in usable}
+
+        if not self.fonts_names:
+            raise ValueError(f'no font of {fonts_path} draws the alphabet')
+
+        self._font_paths = list(self.fonts_names.values())
+
         if isinstance(font_size, list):
             self.font_size = font_size
         elif isinstance(font_size, int):
@@ -29,109 +71,177 @@ class RowGenerator():
 
         self.font_color_range = font_color_range
 
-    def _union_rects(self, rects: np.ndarray) -> Tuple[int, int, int, int]:
-        rects = rects.T
-        x = min(rects[0])
-        y = min(rects[1])
-        w = max(rects[0] + rects[2]) - x
-        h = max(rects[1] + rects[3]) - y
-        return x, y, w, h
+    def fonts_for(self, text: str) -> list:
+        '''paths of the fonts that draw every char of text, the ones missing the fewest chars if none does'''
+        return self.font_index.covering(self._font_paths, text)
+
+    def covered_text(self, font_paths: list = None) -> str:
+        '''a generated text, generated again (up to _text_attempts times) while none of font_paths draws it whole'''
+        font_paths = font_paths or self._font_paths
+        text = self.text_gen.generate()
+
+        for _ in range(self._text_attempts):
+            if self.font_index.draws(font_paths, text):
+                break
+
+            metrics.count('row.resampled_texts')
+            text = self.text_gen.generate()
+
+        return text
+
+    def drop_missing(self, font_path: str, text: str) -> str:
+        '''text without the chars the font draws as tofu or not at all, the last resort after covered_text'''
+        missing = self.font_index.missing.get(font_path, frozenset()).intersection(text)
+
+        if missing:
+            metrics.count('row.dropped_texts')
+            metrics.count('row.dropped_chars', sum(char in missing for char in text))
+            text = ''.join(char for char in text if char not in missing) or text
+
+        return text
 
     def _get_char_code(self, char: str) -> int:
         if self.alphabet.find(char) >= 0:
             return self.alphabet.find(char) + 1
 
-    def generate(self, text: str = None, font_name: str = None, font_size: tuple = None,
-                 font_color: Tuple[int, int, int] = None, bold: bool = False) -> Tuple[Image.Image, np.ndarray, str]:
+    def layout(self, text: str = None, font_name: str = None, font_size: tuple = None,
+               font_color: Tuple[int, int, int] = None, bold: bool = False) -> RowLayout:
+        with metrics.timer('row.layout'):
+            return self._layout(text, font_name, font_size, font_color, bold)
+
+    def _layout(self, text: str, font_name: str, font_size: tuple,
+                font_color: Tuple[int, int, int], bold: bool) -> RowLayout:
         if not text:
-            text = self.text_gen.generate()
+            text = self.covered_text()
 
         if font_name not in self.fonts_names.keys():
-            font_name = random.choice(list(self.fonts_names.values()))
+            font_name = self.rng.choice(self.fonts_for(text))
         else:
             font_name = self.fonts_names[font_name]
 
+        text = self.drop_missing(font_name, text)
+
         if not font_size:
-            font_size = random.uniform(*self.font_size)
+            font_size = self.rng.uniform(*self.font_size)
 
         if not font_color:
-            font_color = (random.randint(*self.font_color_range[0]),
-                          random.randint(*self.font_color_range[1]),
-                          random.randint(*self.font_color_range[2]))
+            font_color = (self.rng.randint(*self.font_color_range[0]),
+                          self.rng.randint(*self.font_color_range[1]),
+                          self.rng.randint(*self.font_color_range[2]))
 
         stroke_width = 0
 
         if bold:
             stroke_width = 1
 
-        _font_base_size = 50
-        font = ImageFont.truetype(font_name, size=_font_base_size)
+        glyphs, box = self._glyphs(text, font_name, stroke_width)
+        scale = self.rng.choice(self.font_size) / self._font_base_size
+        y = max(int((box[3] - box[1]) * scale), 1)
+        x = max(int(y * (box[2] - box[0]) / (box[3] - box[1])), 1)
+        return RowLayout(text, font_name, stroke_width, font_color, glyphs, box, (x, y))
 
+    def _glyphs(self, text: str, font_name: str, stroke_width: int) -> Tuple[list, tuple]:
+        '''glyphs (step, glyph, char code) of text at the base size and the box of its labelled chars'''
+        font = self.glyph_cache.font(font_name, self._font_base_size)
         text_size = list(font.getsize(text))
         text_size[0] = int(text_size[0] * 1.5)
         text_size[1] = int(text_size[1] * 2)
-        text_crop = Image.new(size=text_size, mode='RGBA', color=(255, 0, 0, 0))
-        text_draw = ImageDraw.Draw(text_crop)
-        grid_crop = np.zeros((len(self.alphabet) + 1, text_size[1], text_size[0]))
-        zero_layer = np.ones((text_size[1], text_size[0]))
+        glyphs = []
+        box = [text_size[0], text_size[1], 0, 0]
         step = 0
 
         for char in text:
-            char_size = font.getsize(char)
+            glyph = self.glyph_cache.glyph(font_name, self._font_base_size, stroke_width, char)
 
             if char == ' ':
-                step += char_size[0]
+                step += glyph.advance[0]
                 continue
 
-            char_crop = Image.new(size=char_size, mode='RGB', color=(255, 255, 255))
-            char_draw = ImageDraw.Draw(char_crop)
-            char_draw.text((0, 0), char, font=font, fill=(0, 0, 0),
-                           stroke_width=stroke_width, stroke_fill=(0, 0, 0))
-            char_crop = np.array(char_crop)
-            gray = cv2.cvtColor(char_crop, cv2.COLOR_BGR2GRAY)
-            gray = 255 - gray
-            char_crop, char_crop = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY)
-            cnts = cv2.findContours(char_crop, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)[0]
-            rects = []
-
-            for cnt in cnts:
-                rects.append(list(cv2.boundingRect(cnt)))
-
-            if len(rects) > 1:
-                x, y, w, h = self._union_rects(np.array(rects))
-
-            else:
-                x, y, w, h = rects[0]
-
             char_code = self._get_char_code(char)
-            grid_crop[char_code] = cv2.rectangle(grid_crop[char_code],
-                                                 (step + x, y),
-                                                 (step + x + w, y + h),
-                                                 1, -1)
-            zero_layer = cv2.rectangle(zero_layer,
-                                       (step + x, y),
-                                       (step + x + w, y + h),
-                                       0, -1)
-            text_draw.text((step, 0), char, font=font, fill=font_color,
-                           stroke_width=stroke_width, stroke_fill=font_color)
-            step += char_size[0]
-
-        ys, xs = np.where(zero_layer == 0)
-        box = (min(xs), min(ys), max(xs), int(max(ys) * 1.05))
-        text_crop = text_crop.crop(box)
-        zero_layer = zero_layer[box[1]:box[3], box[0]:box[2]]
-        grid_crop = grid_crop[:, box[1]:box[3], box[0]:box[2]]
-        scale = random.choice(self.font_size) / _font_base_size
-        y = int(text_crop.size[1] * scale)
-        x = int(y * text_crop.size[0] / text_crop.size[1])
-        new_size = (x, y)
-        text_crop = text_crop.resize(new_size)
-        resized_grid_crop = []
-
-        for layer in grid_crop:
-            layer = cv2.resize(layer, new_size, interpolation=cv2.INTER_NEAREST)
-            resized_grid_crop.append(layer)
-
-        grid_crop = np.array(resized_grid_crop)
-
-        return text_crop, grid_crop, text
+            glyphs.append((step, glyph, char_code))
+
+            if glyph.bbox and char_code:
+                x, y, w, h = glyph.bbox
+                box = [min(box[0], step + x), min(box[1], y),
+                       max(box[2], step + x + w), max(box[3], y + h)]
+
+            step += glyph.advance[0]
+
+        if box[0] > box[2]:
+            box = [0, 0, text_size[0] - 1, text_size[1] - 1]
+
+        box = (box[0], box[1], min(box[2], text_size[0] - 1), int(min(box[3], text_size[1] - 1) * 1.05))
+        return glyphs, box
+
+    def resized(self, layout: RowLayout, scale: float) -> RowLayout:
+        '''the layout scaled down by scale, not below the min font size'''
+        left, top, right, bottom = layout.box
+        min_h = max(int((bottom - top) * min(self.font_size) / self._font_base_size), 1)
+        y = max(int(layout.size[1] * min(scale, 1)), min(min_h, layout.size[1]))
+        x = max(int(y * (right - left) / (bottom - top)), 1)
+        return layout._replace(size=(x, y))
+
+    def shortened(self, layout: RowLayout, width: int) -> Union[RowLayout, None]:
+        '''the layout at its font size with the trailing words dropped to be at most width wide,
+        None if the first word is wider'''
+        words = layout.text.split(' ')
+        scale = layout.size[1] / (layout.box[3] - layout.box[1])
+
+        while len(words) > 1:
+            words.pop()
+            text = ' '.join(words)
+            glyphs, box = self._glyphs(text, layout.font_path, layout.stroke_width)
+            y = max(int((box[3] - box[1]) * scale), 1)
+            x = max(int(y * (box[2] - box[0]) / (box[3] - box[1])), 1)
+
+            if x <= width:
+                return layout._replace(text=text, glyphs=glyphs, box=box, size=(x, y))
+
+        return None
+
+    def render(self, layout: RowLayout, with_mask: bool = True) -> Tuple[Image.Image, np.ndarray]:
+        '''the row crop and its chargrid mask, None instead of the mask if not with_mask'''
+        with metrics.timer('row.render'):
+            return self._render(layout, with_mask)
+
+    def _render(self, layout: RowLayout, with_mask: bool = True) -> Tuple[Image.Image, np.ndarray]:
+        left, top, right, bottom = layout.box
+        text_crop = Image.new(size=(right - left, bottom - top), mode='RGBA', color=(255, 0, 0, 0))
+        grid_crop = masks.new_mask(len(self.alphabet) + 1, bottom - top, right - left, self.mask_format) \
+            if with_mask else None
+
+        for step, glyph, char_code in layout.glyphs:
+            if with_mask and glyph.bbox and char_code:
+                x, y, w, h = glyph.bbox
+                grid_crop = masks.fill_rect(grid_crop, char_code, step + x - left, y - top,
+                                            min(step + x + w, right) - left, min(y + h, bottom) - top)
+
+            text_crop.paste(layout.font_color, (step + glyph.offset[0] - left, glyph.offset[1] - top), glyph.mask)
+
+        text_crop = text_crop.resize(layout.size)
+        grid_crop = masks.resize(grid_crop, layout.size) if with_mask else None
+        return text_crop, grid_crop
+
+    def char_boxes(self, layout: RowLayout) -> Iterator[Tuple[int, int, int, int, int]]:
+        '''(char code, x0, y0, x1, y1) of the labelled char boxes in the rendered crop, x1 and y1 exclusive'''
+        left, top, right, bottom = layout.box
+        (w, h), (rw, rh) = (right - left, bottom - top), layout.size
+
+        for step, glyph, char_code in layout.glyphs:
+            if glyph.bbox and char_code:
+                x, y, bw, bh = glyph.bbox
+                x0, y0 = step + x - left, y - top
+                x1, y1 = min(step + x + bw + 1, right) - left, min(y + bh + 1, bottom) - top
+                # the nearest-neighbour resize labels the crop pixels i with x0 <= floor(i * w / rw) < x1
+                yield char_code, -(-x0 * rw // w), -(-y0 * rh // h), -(-x1 * rw // w), -(-y1 * rh // h)
+
+    def char_centers(self, layout: RowLayout) -> Iterator[Tuple[int, float, float]]:
+        '''(char code, x, y) of the char box centers of the labelled chars in the rendered crop'''
+        for char_code, x0, y0, x1, y1 in self.char_boxes(layout):
+            yield char_code, (x0 + x1) / 2, (y0 + y1) / 2
+
+    def generate(self, text: str = None, font_name: str = None, font_size: tuple = None,
+                 font_color: Tuple[int, int, int] = None, bold: bool = False) -> Tuple[Image.Image, np.ndarray, str]:
+        layout = self.layout(text, font_name, font_size, font_color, bold)
+        text_crop, grid_crop = self.render(layout)
+        return text_crop, grid_crop, layout.text
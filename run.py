@@ -1,7 +1,6 @@
 import yaml
 import argparse
 
-from plotter import Plotter
 from generator import Generator
 
 
@@ -9,14 +8,17 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('-c', '--config', type=str, default='config.yaml', help='Config file')
     parser.add_argument('-d', '--debug', type=bool, default=True, help='Save debug images')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='Generation processes, overrides config')
     args = parser.parse_args()
 
     with open(args.config) as f:
         config = yaml.safe_load(f)
 
     generator = Generator(config)
-    generator.generate()
+    generator.generate(workers=args.workers)
 
     if args.debug:
+        from plotter import Plotter
+
         plotter = Plotter('gen_data')
-        plotter.plot(plot_rows=True, plot_chars=True)
+        plotter.plot(plot_rows=True, plot_chars=True, workers=args.workers or generator.workers)
@@ -1,36 +1,79 @@
 import random
+import masks
 import numpy as np
 
 from collections import namedtuple
-from copy import copy
-from typing import List, Tuple
-from PIL import Image, ImageDraw, ImageFont
+from typing import Iterator, List, Tuple
+from glyph_cache import Glyph
+from PIL import Image, ImageDraw
 from row_generator import RowGenerator
 
 
+'''
+TableGenerator.layout()
+picks the table text and the font, size and color of every cell,
+measures the cells once from the glyph cache advances
+
+TableGenerator.render(layout, char_mask, left_top, with_mask)
+draws the lines and every cell glyph straight onto the table image,
+char labels are written into char_mask at left_top (a new table mask if it is None, no mask if not with_mask),
+a label covers the glyph box as in the RowGenerator masks, one px wider and higher than the ink
+'''
+
+
+TableLayout = namedtuple('TableLayout', ['tdata', 'align', 'width', 'cell_pad', 'margin', 'cells',
+                                         'col_max_wid', 'row_max_hei', 'size'])
+TableCell = namedtuple('TableCell', ['font_path', 'font_size', 'font_color', 'width', 'height', 'glyphs'])
+
+
 class TableGenerator():
-    def __init__(self, cells_range: tuple, text_generator: RowGenerator, size_range: tuple) -> None:
+    def __init__(self, cells_range: tuple, text_generator: RowGenerator, size_range: tuple,
+                 font_path: str = None, font_size: int = None, rng: random.Random = None) -> None:
         self.text_generator = text_generator
+        # the row generator stream by default
+        self.rng = rng or text_generator.rng
         self.cells_range = cells_range
         self.size_range = size_range
+        self.font_path = font_path
+        self.font_size = font_size
 
-    def generate(self) -> Image.Image:
+    def layout(self) -> TableLayout:
         tdata = []
-        cells = (random.randint(1, self.cells_range[0]),
-                 random.randint(1, self.cells_range[1]))
+        cells = (self.rng.randint(1, self.cells_range[0]),
+                 self.rng.randint(1, self.cells_range[1]))
 
         for y in range(cells[1]):
             row = []
             for x in range(cells[0]):
-                text = self.text_generator.text_gen.generate()
+                text = self.text_generator.covered_text([self.font_path] if self.font_path else None)
                 row.append(text)
             tdata.append(row)
 
-        align = [random.choice(['l', 'r', 'c'])] * cells[0]
-        width = random.randint(2, 5)
-        table, grid = self._plot_table(tdata, align=align, width=width)
+        align = [self.rng.choice(['l', 'r', 'c'])] * cells[0]
+        width = self.rng.randint(2, 5)
+        # every cell gets its own font, size and color, as a row does
+        color_range = self.text_generator.font_color_range
+        fonts = []
+
+        for row in tdata:
+            fonts.append([])
+
+            for j, text in enumerate(row):
+                font_path = self.font_path or self.rng.choice(self.text_generator.fonts_for(text))
+                row[j] = self.text_generator.drop_missing(font_path, text)
+                fonts[-1].append((font_path, self.font_size or self.rng.randint(*self.size_range),
+                                  tuple(self.rng.randint(*color_range[c]) for c in range(3))))
+
+        return self._measure_table(tdata, fonts, align=align, width=width)
+
+    def render(self, layout: TableLayout, char_mask: np.ndarray = None,
+               left_top: Tuple[int, int] = (0, 0), with_mask: bool = True) -> Tuple[Image.Image, np.ndarray]:
+        return self._plot_table(layout, char_mask, left_top, with_mask=with_mask)
 
-        return table, grid, tdata
+    def generate(self) -> Tuple[Image.Image, np.ndarray, List[List[str]]]:
+        layout = self.layout()
+        table, grid = self.render(layout)
+        return table, grid, layout.tdata
 
     def _position_tuple(self, *args) -> tuple:
         Position = namedtuple('Position', ['top', 'right', 'bottom', 'left'])
@@ -45,18 +88,52 @@ class TableGenerator():
         else:
             return Position(args[0], args[1], args[2], args[3])
 
-    def _plot_table(self, table: List[str],
-                    cell_pad=(30, 5), margin=(1, 1), align=['l', 'r', 'c'], colors={}, width=2) -> Image.Image:
+    def _measure_table(self, table: List[str], fonts: List[list],
+                       cell_pad=(30, 5), margin=(1, 1), align=['l', 'r', 'c'], width=2) -> TableLayout:
         """
-        Draw a table using only Pillow
+        Measure a table
         table:    an 2d list, must be str
+        fonts:    (font_path, font_size, font_color) of every cell, an 2d list as table
         cell_pad: padding for cell, (top_bottom, left_right)
         margin:   margin for table, css-like shorthand
         align:    None or list, 'l'/'c'/'r' for left/center/right, length must be the max count of columns
+        cells:    TableCell of every cell, glyphs are (step, glyph, char_code) as in RowLayout
+        """
+
+        _margin = self._position_tuple(*margin)
+        cells = [[self._measure_cell(cell, *font) for cell, font in zip(row, row_fonts)]
+                 for row, row_fonts in zip(table, fonts)]
+        row_max_hei = [max([cell.height for cell in row], default=0) for row in cells]
+        col_max_wid = [0] * len(max(table, key=len))
+        for row in cells:
+            for j, cell in enumerate(row):
+                col_max_wid[j] = max(cell.width, col_max_wid[j])
+        tab_width = sum(col_max_wid) + len(col_max_wid) * 2 * cell_pad[0]
+        tab_heigh = sum(row_max_hei) + len(row_max_hei) * 2 * cell_pad[1]
+        size = (tab_width + _margin.left + _margin.right, tab_heigh + _margin.top + _margin.bottom)
+
+        return TableLayout(table, align, width, cell_pad, _margin, cells, col_max_wid, row_max_hei, size)
+
+    def _measure_cell(self, text: str, font_path: str, font_size: int, font_color: tuple) -> TableCell:
+        glyphs = []
+        step, height = 0, 0
+
+        for char in text:
+            glyph = self.text_generator.glyph_cache.glyph(font_path, font_size, 0, char)
+            glyphs.append((step, glyph, self.text_generator._get_char_code(char)))
+            step += glyph.advance[0]
+            height = max(height, glyph.advance[1])
+
+        return TableCell(font_path, font_size, font_color, step, height, glyphs)
+
+    def _plot_table(self, layout: TableLayout, char_mask: np.ndarray = None,
+                    left_top: Tuple[int, int] = (0, 0), colors={},
+                    with_mask: bool = True) -> Tuple[Image.Image, np.ndarray]:
+        """
+        Draw a measured table using only Pillow
         colors:   dict, as follows
         """
 
-        font = ImageFont.truetype("/home/user0/projects/O/data_for_gen/fonts/a_AlgeriusNr.TTF", 30)
         _color = {
             'bg': (0, 0, 0, 0),
             'cell_bg': (0, 0, 0, 0),
@@ -68,20 +145,12 @@ class TableGenerator():
             'green': 'green',
         }
         _color.update(colors)
-        _margin = self._position_tuple(*margin)
-
-        table = table.copy()
-        row_max_hei = [0] * len(table)
-        col_max_wid = [0] * len(max(table, key=len))
-        for i in range(len(table)):
-            for j in range(len(table[i])):
-                col_max_wid[j] = max(font.getsize(table[i][j])[0], col_max_wid[j])
-                row_max_hei[i] = max(font.getsize(table[i][j])[1], row_max_hei[i])
+        width, cell_pad, _margin = layout.width, layout.cell_pad, layout.margin
+        col_max_wid, row_max_hei = layout.col_max_wid, layout.row_max_hei
         tab_width = sum(col_max_wid) + len(col_max_wid) * 2 * cell_pad[0]
         tab_heigh = sum(row_max_hei) + len(row_max_hei) * 2 * cell_pad[1]
 
-        tab = Image.new('RGBA', (tab_width + _margin.left + _margin.right, tab_heigh + _margin.top + _margin.bottom),
-                        _color['bg'])
+        tab = Image.new('RGBA', layout.size, _color['bg'])
 
         draw = ImageDraw.Draw(tab)
 
@@ -100,40 +169,52 @@ class TableGenerator():
             left += col_w + cell_pad[0] * 2
         draw.line([(left, _margin.top), (left, tab_heigh + _margin.top)], fill=_color['colline'], width=width)
 
-        grid = np.zeros((len(self.text_generator.alphabet) + 1, tab_heigh + _margin.top, tab_width + _margin.left))
-        grid[0] = grid[0] + 1
+        if char_mask is None and with_mask:
+            char_mask = masks.new_mask(len(self.text_generator.alphabet) + 1, tab_heigh + _margin.top,
+                                       tab_width + _margin.left, self.text_generator.mask_format)
+
+        for x, y, cell, glyph, char_code in self._glyphs(layout):
+            tab.paste(cell.font_color, (x + glyph.offset[0], y + glyph.offset[1]), glyph.mask)
+
+            if with_mask and glyph.bbox and char_code:
+                bx, by, bw, bh = glyph.bbox
+                masks.fill_rect(char_mask, char_code, left_top[0] + x + bx, left_top[1] + y + by,
+                                left_top[0] + x + bx + bw, left_top[1] + y + by + bh)
+
+        return tab, char_mask
+
+    def char_boxes(self, layout: TableLayout,
+                   left_top: Tuple[int, int] = (0, 0)) -> Iterator[Tuple[int, int, int, int, int]]:
+        '''(char code, x0, y0, x1, y1) of the labelled char boxes of a table placed at left_top, x1 and y1 exclusive'''
+        for x, y, _, glyph, char_code in self._glyphs(layout):
+            if glyph.bbox and char_code:
+                bx, by, bw, bh = glyph.bbox
+                x0, y0 = left_top[0] + x + bx, left_top[1] + y + by
+                yield char_code, x0, y0, x0 + bw + 1, y0 + bh + 1
+
+    def char_centers(self, layout: TableLayout,
+                     left_top: Tuple[int, int] = (0, 0)) -> Iterator[Tuple[int, float, float]]:
+        '''(char code, x, y) of the char box centers of the labelled chars, placed at left_top'''
+        for char_code, x0, y0, x1, y1 in self.char_boxes(layout, left_top):
+            yield char_code, (x0 + x1) / 2, (y0 + y1) / 2
+
+    def _glyphs(self, layout: TableLayout) -> Iterator[Tuple[int, int, TableCell, Glyph, int]]:
+        '''(x, y, cell, glyph, char code) of every cell glyph in table coords'''
+        align, cell_pad, _margin = layout.align, layout.cell_pad, layout.margin
+        col_max_wid, row_max_hei = layout.col_max_wid, layout.row_max_hei
 
         top, left = _margin.top + cell_pad[1], 0
-        for i in range(len(table)):
+        for i in range(len(layout.tdata)):
             left = _margin.left + cell_pad[0]
-            for j in range(len(table[i])):
+            for j in range(len(layout.tdata[i])):
+                cell = layout.cells[i][j]
                 _left = left
                 if align and align[j] == 'c':
-                    _left += (col_max_wid[j] - font.getsize(table[i][j])[0]) // 2
+                    _left += (col_max_wid[j] - cell.width) // 2
                 elif align and align[j] == 'r':
-                    _left += col_max_wid[j] - font.getsize(table[i][j])[0]
-                crop, cm, text = self.text_generator.generate(text=table[i][j])
-                tab.paste(crop, (_left, top), crop)
-                grid = self._paste_grid_mask(cm, (_left, top), copy(grid))
+                    _left += col_max_wid[j] - cell.width
+
+                for step, glyph, char_code in cell.glyphs:
+                    yield _left + step, top, cell, glyph, char_code
                 left += col_max_wid[j] + cell_pad[0] * 2
             top += row_max_hei[i] + cell_pad[1] * 2
-
-        return tab, grid
-
-    def _paste_grid_mask(self, grid_crop: np.ndarray,
-                         left_top: Tuple[int, int], char_mask: np.ndarray) -> np.ndarray:
-        for i in range(grid_crop.shape[0]):
-            layer = Image.fromarray(grid_crop[i] * 255)
-            layer = layer.convert('RGBA')
-
-            if i == 0:
-                back = Image.new('RGBA', layer.size, (255,) * 4)
-            else:
-                back = Image.new('RGBA', layer.size, (0,) * 4)
-
-            layer = Image.composite(layer, back, layer)
-            layer = layer.convert('1')
-            char_mask[i, left_top[1]:left_top[1] + layer.size[1],
-                      left_top[0]:left_top[0] + layer.size[0]] = np.array(layer)
-
-        return char_mask
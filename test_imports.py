@@ -0,0 +1,14 @@
+import pytest
+
+from benchmark import bench_imports, check_imports
+
+
+'''
+import time and peak RSS budget of the entry modules, each imported in a fresh interpreter
+(python -m pytest test_imports.py), see benchmark.py imports
+'''
+
+
+@pytest.mark.parametrize('module', ['generator', 'dataset_reader', 'run'])
+def test_import_budget(module: str) -> None:
+    assert check_imports(bench_imports(module)) == []
@@ -0,0 +1,99 @@
+import os
+import re
+import json
+import numpy as np
+
+from typing import List
+
+
+'''
+CorpusIndex(text_path, alphabet, index_path)
+a word index of a source text, built once and memory-mapped by all processes
+
+index_path.bytes        words of the text split on whitespace, with chars out of the alphabet removed,
+                        concatenated as utf-8, empty words and '.' dropped
+index_path.offsets.npy  int64 (num words + 1) byte offsets of the words
+index_path.json         the text path, size, mtime and alphabet the index was built for,
+                        the index is rebuilt if they change
+
+the text is read in chunks, so building takes O(chunk) memory
+'''
+
+
+class CorpusIndex():
+    def __init__(self, text_path: str, alphabet: str, index_path: str = None, chunk_size: int = 2 ** 24) -> None:
+        self.text_path = text_path
+        self.alphabet = alphabet
+        self.index_path = index_path or text_path + '.index'
+        self.chunk_size = chunk_size
+        meta = {'text_path': os.path.abspath(text_path), 'size': os.path.getsize(text_path),
+                'mtime': os.path.getmtime(text_path), 'alphabet': alphabet}
+
+        if self._load_meta() != meta:
+            self._build(meta)
+
+        self.offsets = np.load(self.index_path + '.offsets.npy', mmap_mode='r')
+        self.data = np.memmap(self.index_path + '.bytes', dtype=np.uint8, mode='r') if self.offsets[-1] else b''
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def word(self, i: int) -> str:
+        return bytes(self.data[self.offsets[i]:self.offsets[i + 1]]).decode('utf-8')
+
+    def words(self, i: int, n: int) -> List[str]:
+        '''n consecutive words from i, fewer at the end of the text'''
+        offsets = self.offsets[i:i + n + 1].tolist()
+        data = bytes(self.data[offsets[0]:offsets[-1]])
+        return [data[a - offsets[0]:b - offsets[0]].decode('utf-8') for a, b in zip(offsets, offsets[1:])]
+
+    def _load_meta(self) -> dict:
+        paths = [self.index_path + ext for ext in ('.json', '.bytes', '.offsets.npy')]
+
+        if not all(os.path.exists(path) for path in paths):
+            return None
+
+        with open(self.index_path + '.json', 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _build(self, meta: dict) -> None:
+        # chars out of the alphabet are removed, whitespace still splits words
+        drop = re.compile(f'[^\\s{re.escape(self.alphabet)}]') if self.alphabet else None
+        offsets = [np.zeros(1, dtype=np.int64)]
+        end = 0
+        rest = ''
+
+        with open(self.text_path, 'r', encoding='utf-8') as tf, open(self.index_path + '.bytes.tmp', 'wb') as bf:
+            while True:
+                chunk = tf.read(self.chunk_size)
+                text = rest + chunk
+
+                # the last word of a chunk can continue in the next one
+                cut = len(text)
+
+                if chunk:
+                    while cut and not text[cut - 1].isspace():
+                        cut -= 1
+
+                text, rest = text[:cut], text[cut:]
+
+                if drop:
+                    text = drop.sub('', text)
+
+                words = [w.encode('utf-8') for w in text.split() if w != '.']
+
+                if words:
+                    bf.write(b''.join(words))
+                    lengths = np.cumsum([len(w) for w in words], dtype=np.int64)
+                    offsets.append(lengths + end)
+                    end += int(lengths[-1])
+
+                if not chunk:
+                    break
+
+        np.save(self.index_path + '.offsets.tmp.npy', np.concatenate(offsets))
+        os.replace(self.index_path + '.bytes.tmp', self.index_path + '.bytes')
+        os.replace(self.index_path + '.offsets.tmp.npy', self.index_path + '.offsets.npy')
+
+        with open(self.index_path + '.json', 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
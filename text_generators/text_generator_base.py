@@ -1,6 +1,14 @@
+import random
+
+
 class TextGeneratorBase():
-    def __init__(self, alphabet: str = ''):
+    '''
+    rng: a random.Random to draw from, the random module by default
+    '''
+
+    def __init__(self, alphabet: str = '', rng: random.Random = None):
         self.alphabet = alphabet
+        self.rng = rng or random
 
     def generate(self):
         pass
@@ -1,28 +1,34 @@
-import re
 import random
 
+from typing import List
+from .corpus_index import CorpusIndex
 from .text_generator_base import TextGeneratorBase
 
 
 class WordFromText(TextGeneratorBase):
-    def __init__(self, text_path: str, alphabet: str = '') -> None:
-        super().__init__(alphabet)
-
-        with open(text_path, 'r', encoding='utf-8') as tf:
-            words = tf.read().split(' ')
-
-        words = [w for w in words if not w.isspace() and len(w) > 0]
-        self.words = []
-
-        for word in words:
-            parts = re.split(r'\n|\t|\r', word)
-            self.words.extend(parts)
+    '''
+    words from a source text, sampled from a memory-mapped CorpusIndex
+    words_in_row: random num of consecutive text words in a row, [1, 1] gives single words
+    max_row_len:  [optional] max row length in chars, words are dropped from the row end to fit
+    index_path:   [optional] index files prefix, text_path.index by default
+    '''
+
+    def __init__(self, text_path: str, alphabet: str = '', words_in_row: List[int] = [1, 1],
+                 max_row_len: int = None, index_path: str = None, rng: random.Random = None) -> None:
+        super().__init__(alphabet, rng)
+        self.words_in_row = words_in_row
+        self.max_row_len = max_row_len
+        self.index = CorpusIndex(text_path, alphabet, index_path)
 
     def generate(self) -> str:
-        word = random.choice(self.words)
-        word = ''.join([char for char in word if char in self.alphabet])
+        if not len(self.index):
+            return self.alphabet[0]
+
+        i = self.rng.randrange(len(self.index))
+        words = self.index.words(i, self.rng.randint(*self.words_in_row))
 
-        if not word or word == '.':
-            word = self.alphabet[0]
+        if self.max_row_len:
+            while len(words) > 1 and sum(len(w) for w in words) + len(words) - 1 > self.max_row_len:
+                words.pop()
 
-        return word
+        return ' '.join(words)
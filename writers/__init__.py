@@ -0,0 +1,5 @@
+from .writer_base import WriterBase, decode_member
+from .file_writer import FileWriter, read_manifest
+from .shard_writer import ShardWriter, ShardReader
+from .recipe_writer import RecipeWriter, RecipeReader
+from .async_writer import AsyncWriter
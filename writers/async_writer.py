@@ -0,0 +1,105 @@
+import queue
+import threading
+
+from typing import Dict, List
+from concurrent.futures import Future, ThreadPoolExecutor
+from .writer_base import WriterBase
+from .file_writer import FileWriter
+from .shard_writer import ShardWriter
+from .recipe_writer import RecipeWriter
+
+
+'''
+AsyncWriter(save_path, writer, threads, queue_size)
+runs another writer off the generation thread:
+write_sample encodes pages on a pool of threads, a committer thread writes them with the wrapped writer
+in submission order, so the wrapped writer is used from a single thread and its manifest / index stays ordered
+
+at most queue_size pages wait to be written, write and write_sample block while the queue is full
+flush waits for every queued page, close flushes and closes the wrapped writer,
+an error of the committer is raised by the next write, flush or close
+'''
+
+
+class AsyncWriter(WriterBase):
+    def __init__(self, save_path: str, writer: dict = {'FileWriter': {}},
+                 threads: int = 2, queue_size: int = 8) -> None:
+        super().__init__(save_path)
+        self.writer = globals()[list(writer.keys())[0]](**list(writer.values())[0], save_path=save_path)
+        self.threads = threads
+        self.queue = queue.Queue(queue_size)
+        self.pool = None
+        self.committer = None
+        self.error = None
+
+    def encode(self, sample: dict) -> Dict[str, bytes]:
+        return self.writer.encode(sample)
+
+    def save_config(self, config: dict) -> None:
+        self.writer.save_config(config)
+
+    def next_name(self) -> int:
+        return self.writer.next_name()
+
+    def missing_names(self) -> List[int]:
+        return self.writer.missing_names()
+
+    def write(self, name: int, members: Dict[str, bytes]) -> None:
+        future = Future()
+        future.set_result(members)
+        self._put(name, future)
+
+    def write_sample(self, name: int, sample: dict) -> None:
+        self._start()
+        self._put(name, self.pool.submit(self.writer.encode, sample))
+
+    def flush(self) -> None:
+        if self.committer is not None:
+            self.queue.join()
+
+        self._raise()
+
+    def close(self) -> None:
+        try:
+            if self.committer is not None:
+                self.queue.put(None)
+                self.committer.join()
+                self.pool.shutdown()
+                self.committer = None
+                self.pool = None
+        finally:
+            self.writer.close()
+
+        self._raise()
+
+    def _start(self) -> None:
+        if self.committer is None:
+            self.pool = ThreadPoolExecutor(self.threads)
+            self.committer = threading.Thread(target=self._commit, daemon=True)
+            self.committer.start()
+
+    def _put(self, name: int, future: Future) -> None:
+        self._raise()
+        self._start()
+        self.queue.put((name, future))
+
+    def _commit(self) -> None:
+        while True:
+            item = self.queue.get()
+
+            try:
+                if item is None:
+                    return
+
+                if self.error is None:
+                    name, future = item
+                    self.writer.write(name, future.result())
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def _raise(self) -> None:
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
@@ -0,0 +1,133 @@
+import os
+import json
+import shutil
+
+from typing import Dict, List
+from .writer_base import WriterBase, _advance, _tail_bytes, _tail_lines
+
+
+class FileWriter(WriterBase):
+    '''
+    a file per member:
+    images/{name}.png, field_masks/{name}.npy, char_masks/{name}.npy, row_coords/{name}.json,
+    field_masks_full/{name}.npy, char_masks_full/{name}.npy if a strided sample keeps full masks,
+    annotations/{name}.npz of vector annotated samples
+
+    manifest.jsonl gets a json line {"name": 12, "next": 13} when all members of a page are in place,
+    "next" is the first name after every written page, so a restart reads only the manifest tail,
+    "missing": [9, 11] lists the names below "next" not written yet (pages finish out of order with workers)
+    a page is written to .partial/{name} first, pages left there by a crash are removed on restart
+    '''
+
+    subfolders = {'png': 'images', 'field_mask.npy': 'field_masks',
+                  'char_mask.npy': 'char_masks', 'json': 'row_coords',
+                  'field_mask_full.npy': 'field_masks_full', 'char_mask_full.npy': 'char_masks_full',
+                  'annotation.npz': 'annotations'}
+
+    def __init__(self, save_path: str, png_compress_level: int = 6) -> None:
+        super().__init__(save_path, png_compress_level)
+        self.manifest_path = os.path.join(save_path, 'manifest.jsonl')
+        self.partial_path = os.path.join(save_path, '.partial')
+        self.manifest = None
+        self.next = None
+        self.missing = []
+
+        # the other folders are made on the first sample that has the member
+        for subfolder in ('images', 'row_coords'):
+            subfolder = os.path.join(save_path, subfolder)
+            if not os.path.exists(subfolder):
+                os.makedirs(subfolder, exist_ok=True)
+
+    def path(self, name: int, member: str) -> str:
+        return os.path.join(self.save_path, self.subfolders[member], f'{name}.{member.split(".")[-1]}')
+
+    def next_name(self) -> int:
+        if self.next is None:
+            self._recover()
+            tail = _tail_lines(self.manifest_path, 1)
+            tail = json.loads(tail[0]) if tail else {}
+            self.next = tail.get('next', 0)
+            self.missing = tail.get('missing', [])
+
+        return self.next
+
+    def missing_names(self) -> List[int]:
+        self.next_name()
+        return list(self.missing)
+
+    def write(self, name: int, members: Dict[str, bytes]) -> None:
+        # recovery cleans .partial, so it runs before the page is staged there
+        next_name = self.next_name()
+        partial = os.path.join(self.partial_path, str(name))
+        os.makedirs(partial, exist_ok=True)
+
+        for member, data in members.items():
+            with open(os.path.join(partial, member), 'wb') as f:
+                f.write(data)
+
+        for member in members:
+            if not os.path.isdir(os.path.dirname(self.path(name, member))):
+                os.makedirs(os.path.dirname(self.path(name, member)), exist_ok=True)
+
+            os.replace(os.path.join(partial, member), self.path(name, member))
+
+        self.next, self.missing = _advance(next_name, self.missing, name)
+        self._append({'name': name, 'next': self.next, **({'missing': self.missing} if self.missing else {})})
+        os.rmdir(partial)
+
+    def close(self) -> None:
+        if self.manifest is not None:
+            self.manifest.close()
+            self.manifest = None
+
+    def _append(self, entry: dict) -> None:
+        if self.manifest is None:
+            self.manifest = open(self.manifest_path, 'a', encoding='utf-8')
+
+        self.manifest.write(json.dumps(entry) + '\n')
+        self.manifest.flush()
+
+    def _recover(self) -> None:
+        '''removes pages a crash left unfinished, writes a manifest for folders written without one'''
+        partials = os.listdir(self.partial_path) if os.path.isdir(self.partial_path) else []
+
+        if partials:
+            # pages are committed in write order, a finished page of .partial is one of the last manifest lines
+            committed = {json.loads(line)['name'] for line in _tail_lines(self.manifest_path, len(partials))}
+
+            for name in partials:
+                if not name.isdigit() or int(name) not in committed:
+                    for member in self.subfolders:
+                        if os.path.exists(self.path(name, member)):
+                            os.remove(self.path(name, member))
+
+                shutil.rmtree(os.path.join(self.partial_path, name))
+
+        if os.path.exists(self.manifest_path):
+            # drop a line the crash left unfinished
+            with open(self.manifest_path, 'rb+') as f:
+                end = f.seek(0, os.SEEK_END)
+                unfinished = _tail_bytes(f, end)
+
+                if unfinished:
+                    f.truncate(end - len(unfinished))
+        else:
+            imgs_path = os.path.join(self.save_path, self.subfolders['png'])
+            names = [f.replace('.png', '') for f in os.listdir(imgs_path) if f.endswith('png')]
+            names = sorted(int(n) for n in names if n.isdigit())
+
+            for name in names:
+                self._append({'name': name, 'next': name + 1})
+
+
+def read_manifest(save_path: str) -> List[int]:
+    '''names of the pages written by FileWriter, in write order'''
+    names = []
+
+    with open(os.path.join(save_path, 'manifest.jsonl'), 'r', encoding='utf-8') as f:
+        for line in f:
+            # a crash can leave the last line unfinished
+            if line.endswith('\n'):
+                names.append(json.loads(line)['name'])
+
+    return names
@@ -0,0 +1,152 @@
+import os
+import json
+import hashlib
+
+from typing import Dict, List
+from .writer_base import WriterBase, _advance, _tail_bytes, _tail_lines
+
+
+'''
+RecipeWriter(save_path)
+stores the recipe of a page instead of the page: a page is fully determined by the generation config,
+the seed and the page index, so it is rebuilt on demand by RecipeReader
+
+save_path/recipes.jsonl gets a json line per page:
+{"name": 12, "next": 13, "config": "3f2a...", "seed": 7, "background": path or null,
+ "rows": [[font path, text], ...], "table": [cells font path, cells text] or null}
+"config" names save_path/configs/{config}.json, the generation config of the page,
+"next" is the first name after every written page and "missing" the names below it not written yet,
+as in the FileWriter manifest
+the resolved background, fonts and texts let RecipeReader check that a rebuilt page is the stored one
+
+RecipeReader(save_path).load(name) renders the page again, bit for bit the page generate would have written,
+it needs the same fonts, backgrounds, source texts and library versions; stable-diffusion pages can not be rebuilt
+fonts and backgrounds are drawn from their sorted file lists, so the folders may list them in any order,
+the stored paths are a check: the draws themselves depend on the number of files, a changed set of files can not
+be replayed from them
+'''
+
+
+class RecipeWriter(WriterBase):
+    def __init__(self, save_path: str) -> None:
+        super().__init__(save_path)
+        self.recipes_path = os.path.join(save_path, 'recipes.jsonl')
+        self.configs_path = os.path.join(save_path, 'configs')
+        self.config_id = None
+        self.recipes = None
+        self.next = None
+        self.missing = []
+
+    def save_config(self, config: dict) -> None:
+        data = json.dumps(config, sort_keys=True, ensure_ascii=False)
+        self.config_id = hashlib.sha1(data.encode('utf-8')).hexdigest()[:16]
+        config_path = os.path.join(self.configs_path, self.config_id + '.json')
+
+        if not os.path.exists(config_path):
+            os.makedirs(self.configs_path, exist_ok=True)
+
+            with open(config_path + '.tmp', 'w', encoding='utf-8') as f:
+                f.write(data)
+
+            os.replace(config_path + '.tmp', config_path)
+
+    def encode(self, sample: dict) -> Dict[str, bytes]:
+        return {'recipe.json': json.dumps(sample['recipe'], ensure_ascii=False).encode('utf-8')}
+
+    def next_name(self) -> int:
+        if self.next is None:
+            self._recover()
+            tail = _tail_lines(self.recipes_path, 1)
+            tail = json.loads(tail[0]) if tail else {}
+            self.next = tail.get('next', 0)
+            self.missing = tail.get('missing', [])
+
+        return self.next
+
+    def missing_names(self) -> List[int]:
+        self.next_name()
+        return list(self.missing)
+
+    def write(self, name: int, members: Dict[str, bytes]) -> None:
+        if self.config_id is None:
+            raise RuntimeError('save_config must be called before pages are written')
+
+        self.next, self.missing = _advance(self.next_name(), self.missing, name)
+        entry = {'name': name, 'next': self.next, **({'missing': self.missing} if self.missing else {}),
+                 'config': self.config_id, **json.loads(members['recipe.json'])}
+
+        if self.recipes is None:
+            os.makedirs(self.save_path, exist_ok=True)
+            self.recipes = open(self.recipes_path, 'a', encoding='utf-8')
+
+        self.recipes.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self.recipes.flush()
+
+    def close(self) -> None:
+        if self.recipes is not None:
+            self.recipes.close()
+            self.recipes = None
+
+    def _recover(self) -> None:
+        '''drops a line a crash left unfinished'''
+        if os.path.exists(self.recipes_path):
+            with open(self.recipes_path, 'rb+') as f:
+                end = f.seek(0, os.SEEK_END)
+                unfinished = _tail_bytes(f, end)
+
+                if unfinished:
+                    f.truncate(end - len(unfinished))
+
+
+class RecipeReader():
+    def __init__(self, save_path: str) -> None:
+        self.save_path = save_path
+        self.recipes = {}
+        self.generators = {}
+
+        with open(os.path.join(save_path, 'recipes.jsonl'), 'r', encoding='utf-8') as f:
+            for line in f:
+                # a crash can leave the last line unfinished
+                if line.endswith('\n'):
+                    recipe = json.loads(line)
+                    self.recipes[recipe['name']] = recipe
+
+        self.names = sorted(self.recipes)
+
+    def recipe(self, name: int) -> dict:
+        return self.recipes[name]
+
+    def config(self, name: int) -> dict:
+        '''the generation config of a page'''
+        with open(os.path.join(self.save_path, 'configs', self.recipes[name]['config'] + '.json'),
+                  'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def load(self, name: int) -> dict:
+        '''
+        the rebuilt page {'image', 'char_mask', 'field_mask', 'row_coords', ...} with the masks
+        in the saved mask_format, as WriterBase.encode gets it
+        '''
+        recipe = self.recipes[name]
+        generator = self._generator(name)
+        page = generator._saved_masks(generator.render_page(name))
+        stored = {key: value for key, value in recipe.items() if key not in ('name', 'next', 'missing', 'config')}
+
+        if page['recipe'] != stored:
+            raise ValueError(f'page {name} does not match its recipe, the fonts, backgrounds or texts changed')
+
+        return page
+
+    def _generator(self, name: int):
+        config_id = self.recipes[name]['config']
+
+        if config_id not in self.generators:
+            # generator imports the writers
+            from generator import Generator
+
+            config = self.config(name)
+            config['Generator'] = {key: value for key, value in config['Generator'].items() if key != 'metrics'}
+            self.generators[config_id] = Generator(config)
+
+        return self.generators[config_id]
+
@@ -0,0 +1,212 @@
+import io
+import os
+import json
+import tarfile
+import numpy as np
+
+from typing import Dict, List, Tuple
+from .writer_base import WriterBase, decode_member, _advance, _tail_bytes
+
+
+'''
+ShardWriter(save_path, shard_size, compress, png_compress_level)
+packs samples into save_path/shards/shard-{n:06d}.tar, shard_size samples per shard,
+members are {name}.png, {name}.field_mask.npy(.npz), {name}.char_mask.npy(.npz), {name}.json,
+masks are np.savez_compressed archives if compress
+
+shard-{n:06d}.idx is the offset index of a shard, a json line per sample appended after the sample is written:
+{"name": 12, "members": {"png": [data offset, size], ...}, "next": 13}
+"next" is the first name after every written sample, "missing" the names below it not written yet, as in FileWriter
+
+on restart the last shard is cut back to its last indexed sample, so a sample a crash left unfinished is dropped
+
+ShardReader(save_path) reads (read) and decodes (load) sample members by name with a seek per member
+'''
+
+
+class ShardWriter(WriterBase):
+    def __init__(self, save_path: str, shard_size: int = 1000, compress: bool = True,
+                 png_compress_level: int = 6) -> None:
+        super().__init__(save_path, png_compress_level)
+        self.shard_size = shard_size
+        self.compress = compress
+        self.shards_path = os.path.join(save_path, 'shards')
+        self.tar = None
+        self.index = None
+        self.count = 0
+        self.next = None
+        self.missing = []
+
+        if not os.path.exists(self.shards_path):
+            os.makedirs(self.shards_path, exist_ok=True)
+
+    def encode(self, sample: dict) -> Dict[str, bytes]:
+        members = super().encode(sample)
+
+        if self.compress:
+            for member in [m[:-len('.npy')] for m in members if m.endswith('.npy')]:
+                buffer = io.BytesIO()
+                np.savez_compressed(buffer, sample[member])
+                del members[f'{member}.npy']
+                members[f'{member}.npz'] = buffer.getvalue()
+
+        return members
+
+    def next_name(self) -> int:
+        if self.next is None:
+            self._recover()
+            entries = _read_index(self._last_index())
+            # shards written before "next" was indexed
+            self.next = entries[-1].get('next', max(e['name'] for e in entries) + 1) if entries else 0
+            self.missing = entries[-1].get('missing', []) if entries else []
+
+        return self.next
+
+    def missing_names(self) -> List[int]:
+        self.next_name()
+        return list(self.missing)
+
+    def _recover(self) -> None:
+        index_path = self._last_index()
+
+        if index_path is None or self.tar is not None:
+            return
+
+        tar_path = index_path[:-len('.idx')] + '.tar'
+
+        with open(index_path, 'rb+') as f:
+            end = f.seek(0, os.SEEK_END)
+            unfinished = _tail_bytes(f, end)
+
+            if unfinished:
+                f.truncate(end - len(unfinished))
+
+        entries = _read_index(index_path)
+
+        if not entries:
+            os.remove(index_path)
+
+            if os.path.exists(tar_path):
+                os.remove(tar_path)
+
+            return
+
+        end = max(offset + size for offset, size in entries[-1]['members'].values())
+        end = -(-end // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+
+        with open(tar_path, 'rb+') as f:
+            f.seek(end)
+            rest = f.read()
+
+            # a closed shard ends with zero blocks, anything else after the last sample is unfinished
+            if len(rest) < 2 * tarfile.BLOCKSIZE or rest.count(0) != len(rest):
+                f.truncate(end)
+                f.seek(end)
+                f.write(bytes(2 * tarfile.BLOCKSIZE))
+
+    def _shards(self) -> List[str]:
+        return sorted(f[:-len('.idx')] for f in os.listdir(self.shards_path) if f.endswith('.idx'))
+
+    def _last_index(self) -> str:
+        shards = self._shards()
+        return os.path.join(self.shards_path, shards[-1] + '.idx') if shards else None
+
+    def _open_shard(self) -> None:
+        self.close()
+        shards = self._shards()
+        shard = f'shard-{int(shards[-1][len("shard-"):]) + 1 if shards else 0:06d}'
+        self.tar = tarfile.open(os.path.join(self.shards_path, shard + '.tar'), 'w')
+        self.index = open(os.path.join(self.shards_path, shard + '.idx'), 'w', encoding='utf-8')
+        self.count = 0
+
+    def write(self, name: int, members: Dict[str, bytes]) -> None:
+        # recovery cuts the last shard, so it runs before a new shard is opened
+        next_name, missing = _advance(self.next_name(), self.missing, name)
+
+        if self.tar is None or self.count >= self.shard_size:
+            self._open_shard()
+
+        offsets = {}
+
+        for member, data in members.items():
+            info = tarfile.TarInfo(f'{name}.{member}')
+            info.size = len(data)
+            self.tar.addfile(info, io.BytesIO(data))
+            # the data block ends at the padded record boundary
+            offsets[member] = [self.tar.offset - -(-len(data) // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE, len(data)]
+
+        self.tar.fileobj.flush()
+        entry = {'name': name, 'members': offsets, 'next': next_name, **({'missing': missing} if missing else {})}
+        self.index.write(json.dumps(entry) + '\n')
+        self.index.flush()
+        self.next, self.missing = next_name, missing
+        self.count += 1
+
+    def close(self) -> None:
+        if self.tar is not None:
+            self.tar.close()
+            self.index.close()
+            self.tar = None
+            self.index = None
+
+
+class ShardReader():
+    def __init__(self, save_path: str) -> None:
+        self.shards_path = os.path.join(save_path, 'shards')
+        self.samples = {}
+
+        for f in sorted(os.listdir(self.shards_path)):
+            if f.endswith('.idx'):
+                tar_path = os.path.join(self.shards_path, f[:-len('.idx')] + '.tar')
+
+                for entry in _read_index(os.path.join(self.shards_path, f)):
+                    self.samples[entry['name']] = (tar_path, entry['members'])
+
+        self.names = sorted(self.samples)
+
+    def members(self, name: int) -> List[str]:
+        return list(self.samples[name][1])
+
+    def member(self, name: int, member: str) -> str:
+        '''the stored member name, 'char_mask' gives char_mask.npy or char_mask.npz'''
+        return self._member(self.samples[name][1], member)
+
+    def locate(self, name: int, member: str) -> Tuple[str, int, int]:
+        '''(tar path, data offset, size) of a member'''
+        tar_path, members = self.samples[name]
+        member = self._member(members, member)
+        return (tar_path, *members[member])
+
+    def read(self, name: int, member: str) -> bytes:
+        tar_path, offset, size = self.locate(name, member)
+
+        with open(tar_path, 'rb') as f:
+            f.seek(offset)
+            return f.read(size)
+
+    def load(self, name: int, member: str):
+        '''reads and decodes a member'''
+        return decode_member(self._member(self.samples[name][1], member), self.read(name, member))
+
+    def _member(self, members: dict, member: str) -> str:
+        # 'char_mask' matches both the .npy and the compressed .npz member
+        for stored in members:
+            if stored == member or stored.rsplit('.', 1)[0] == member:
+                return stored
+
+        raise KeyError(member)
+
+
+def _read_index(index_path: str) -> List[dict]:
+    if index_path is None:
+        return []
+
+    entries = []
+
+    with open(index_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            # a crash can leave the last line unfinished
+            if line.endswith('\n'):
+                entries.append(json.loads(line))
+
+    return entries
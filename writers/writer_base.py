@@ -0,0 +1,130 @@
+import io
+import os
+import json
+import numpy as np
+
+from PIL import Image
+from typing import Dict, List, Tuple
+
+
+class WriterBase():
+    '''
+    encode(sample) turns a page into named members, it runs in the generation process
+    write(name, members) stores the members of page "name"
+    write_sample(name, sample) encodes and stores a page
+    save_config(config) gets the generation config, for writers that rebuild pages from it
+    next_name() the first name after every written page, missing_names() the names below it a crash left unwritten,
+    pages finish out of order with workers, so a restart generates the missing names first
+    sample: {'image': PIL image, 'field_mask': array, 'char_mask': array, 'row_coords': dict,
+             optional 'field_mask_full': array, 'char_mask_full': array, 'annotation': {name: array}}
+             a vector annotated sample has no masks, its annotation is stored as annotation.npz
+    png_compress_level: zlib level of the images, 0 (none, fastest) - 9 (smallest)
+    '''
+
+    def __init__(self, save_path: str, png_compress_level: int = 6) -> None:
+        self.save_path = save_path
+        self.png_compress_level = png_compress_level
+
+    def encode(self, sample: dict) -> Dict[str, bytes]:
+        image = io.BytesIO()
+        sample['image'].save(image, format='PNG', compress_level=self.png_compress_level)
+        row_coords = json.dumps(sample['row_coords'], indent=4, ensure_ascii=False).encode('utf-8')
+        members = {'png': image.getvalue(), 'json': row_coords}
+
+        # full resolution masks of a strided sample
+        for member in ('field_mask', 'char_mask', 'field_mask_full', 'char_mask_full'):
+            if member in sample:
+                members[f'{member}.npy'] = self._encode_array(sample[member])
+
+        if 'annotation' in sample:
+            buffer = io.BytesIO()
+            np.savez_compressed(buffer, **sample['annotation'])
+            members['annotation.npz'] = buffer.getvalue()
+
+        return members
+
+    def _encode_array(self, array: np.ndarray) -> bytes:
+        buffer = io.BytesIO()
+        np.save(buffer, array)
+        return buffer.getvalue()
+
+    def save_config(self, config: dict) -> None:
+        '''called with the generation config before the pages are written'''
+        pass
+
+    def next_name(self) -> int:
+        pass
+
+    def missing_names(self) -> List[int]:
+        return []
+
+    def write(self, name: int, members: Dict[str, bytes]) -> None:
+        pass
+
+    def write_sample(self, name: int, sample: dict) -> None:
+        self.write(name, self.encode(sample))
+
+    def close(self) -> None:
+        pass
+
+
+def decode_member(member: str, data: bytes):
+    '''inverse of WriterBase.encode for one member'''
+    if member.endswith('png'):
+        return Image.open(io.BytesIO(data))
+
+    if member.endswith('json'):
+        return json.loads(data.decode('utf-8'))
+
+    array = np.load(io.BytesIO(data))
+
+    if member.endswith('npz'):
+        # a compressed mask is a single array archive, an annotation is {name: array}
+        array = array['arr_0'] if array.files == ['arr_0'] else dict(array)
+
+    return array
+
+
+def _advance(next_name: int, missing: List[int], name: int) -> Tuple[int, List[int]]:
+    '''next name and missing names once page "name" is written'''
+    if name >= next_name:
+        return name + 1, missing + list(range(next_name, name))
+
+    return next_name, [n for n in missing if n != name]
+
+
+def _tail_bytes(f, end: int, chunk: int = 4096) -> bytes:
+    '''the bytes after the last newline before end'''
+    tail = b''
+
+    while end > 0:
+        start = max(end - chunk, 0)
+        f.seek(start)
+        tail = f.read(end - start) + tail
+        end = start
+
+        if b'\n' in tail:
+            return tail[tail.rindex(b'\n') + 1:]
+
+    return tail
+
+
+def _tail_lines(path: str, n: int, chunk: int = 4096) -> List[str]:
+    '''the last n complete lines of a file, read from its end'''
+    if n <= 0 or not os.path.exists(path):
+        return []
+
+    with open(path, 'rb') as f:
+        end = f.seek(0, os.SEEK_END)
+        data = b''
+
+        while end > 0 and data.count(b'\n') <= n:
+            start = max(end - chunk, 0)
+            f.seek(start)
+            data = f.read(end - start) + data
+            end = start
+
+    lines = data.split(b'\n')
+    # the piece after the last newline is an unfinished line, the first piece may be cut by the chunk
+    lines = lines[:-1] if end == 0 else lines[1:-1]
+    return [line.decode('utf-8') for line in lines[-n:]]